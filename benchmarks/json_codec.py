@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Decode /api/results and /api/records response bytes with the standard
+# library (decode to str first, as Splatoon2.request used to) and with
+# the selected jsoncodec backend.
+#
+# Run from the repository root:
+#   python -m benchmarks.json_codec [rounds]
+import json
+import sys
+import timeit
+
+from benchmarks import payloads
+from sp2bot.utils import jsoncodec
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    print(f'backend: {jsoncodec.backend}')
+    for name, payload in (('/api/results', payloads.results()),
+                          ('/api/records', payloads.records())):
+        raw = json.dumps(payload).encode('utf-8')
+
+        stdlib = timeit.timeit(lambda: json.loads(raw.decode('utf-8')),
+                               number=rounds)
+        codec = timeit.timeit(lambda: jsoncodec.loads(raw), number=rounds)
+        print(f'{name:>13} loads ({len(raw)} bytes): '
+              f'stdlib {stdlib / rounds * 1e6:.0f}us, '
+              f'{jsoncodec.backend} {codec / rounds * 1e6:.0f}us')
+
+        stdlib = timeit.timeit(lambda: json.dumps(payload), number=rounds)
+        codec = timeit.timeit(lambda: jsoncodec.dumps(payload), number=rounds)
+        print(f'{name:>13} dumps: '
+              f'stdlib {stdlib / rounds * 1e6:.0f}us, '
+              f'{jsoncodec.backend} {codec / rounds * 1e6:.0f}us')
+
+
+if __name__ == '__main__':
+    main()
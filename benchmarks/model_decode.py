@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Decode a 50-battle /api/results payload eagerly and lazily and read
+# every `victory` like Message.last50_overview does.
+#
+# Run from the repository root:
+#   python -m benchmarks.model_decode [rounds]
+import json
+import sys
+import time
+import tracemalloc
+
+from benchmarks import payloads
+from sp2bot.splatoon2models import SP2BattleOverview
+
+
+def last50(data, lazy):
+    overview = SP2BattleOverview.de_json(data, lazy=lazy)
+    return sum(1 for battle in overview.results if battle.victory)
+
+
+def measure(data, lazy, rounds):
+    tracemalloc.start()
+    last50(data, lazy)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        last50(data, lazy)
+    elapsed = time.perf_counter() - started
+
+    return {'peak_kb': round(peak / 1024, 1),
+            'us_per_decode': round(elapsed / rounds * 1e6, 1)}
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    data = json.loads(json.dumps(payloads.results()))
+
+    for name, lazy in (('eager', False), ('lazy', True)):
+        print(f'{name:>5}: {measure(data, lazy, rounds)}')
+
+
+if __name__ == '__main__':
+    main()
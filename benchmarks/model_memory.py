@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Bytes kept alive per decoded 8-player battle detail.
+#
+# Run from the repository root:
+#   python -m benchmarks.model_memory [battles]
+import gc
+import json
+import sys
+import tracemalloc
+
+from benchmarks import payloads
+from sp2bot.splatoon2models import SP2BattleResult
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    data = [json.loads(json.dumps(payloads.battle_detail(seed=i)))
+            for i in range(count)]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    battles = [SP2BattleResult.de_json(d) for d in data]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f'battles: {len(battles)}, '
+          f'bytes per battle: {(after - before) / count:.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Payloads shaped like SplatNet 2 responses, used by the benchmarks.
+import random
+
+RULES = [('turf_war', 'Turf War', 'regular'),
+         ('splat_zones', 'Splat Zones', 'gachi'),
+         ('tower_control', 'Tower Control', 'gachi'),
+         ('rainmaker', 'Rainmaker', 'league'),
+         ('clam_blitz', 'Clam Blitz', 'league')]
+RANKS = ['C-', 'C', 'C+', 'B-', 'B', 'B+', 'A-', 'A', 'A+', 'S', 'S+', 'X']
+WEAPONS = ['Splattershot', 'Splat Roller', 'Splat Charger', '.52 Gal',
+           'N-ZAP \'85', 'Hydra Splatling', 'Dualie Squelchers', 'Tri-Slosher']
+
+
+def player(rng, principal_id):
+    rank = rng.choice(RANKS)
+    return {
+        'principal_id': principal_id,
+        'nickname': f'Player_{principal_id[:6]}*',
+        'player_rank': rng.randint(1, 99),
+        'star_rank': rng.randint(0, 5),
+        'player_type': {'style': rng.choice(['boy', 'girl']),
+                        'species': rng.choice(['inklings', 'octolings'])},
+        'weapon': {'id': str(rng.randint(0, 9999)),
+                   'name': rng.choice(WEAPONS),
+                   'image': '/images/weapon/0.png',
+                   'thumbnail': '/images/weapon/0.png',
+                   'sub': {'id': '0', 'name': 'Splat Bomb'},
+                   'special': {'id': '0', 'name': 'Ink Armor'}},
+        'udemae': {'name': rank,
+                   'is_x': rank == 'X',
+                   's_plus_number': rng.randint(0, 9) if rank == 'S+' else None,
+                   'is_number_reached': False},
+        'head_skills': {'main': {'id': '0', 'name': 'Ink Saver (Main)'},
+                        'subs': [{'id': '1', 'name': 'Run Speed Up'}] * 3},
+        'clothes_skills': {'main': {'id': '0', 'name': 'Swim Speed Up'},
+                           'subs': [{'id': '1', 'name': 'Ink Resistance Up'}] * 3},
+        'shoes_skills': {'main': {'id': '0', 'name': 'Stealth Jump'},
+                         'subs': [{'id': '1', 'name': 'Quick Respawn'}] * 3},
+    }
+
+
+def member(rng, principal_id):
+    return {
+        'kill_count': rng.randint(0, 15),
+        'assist_count': rng.randint(0, 6),
+        'death_count': rng.randint(0, 12),
+        'special_count': rng.randint(0, 8),
+        'sort_score': rng.randint(0, 30),
+        'game_paint_point': rng.randint(300, 1500),
+        'player': player(rng, principal_id),
+    }
+
+
+def battle(rng, battle_number, detail=False):
+    key, name, battle_type = rng.choice(RULES)
+    victory = rng.random() < 0.5
+    data = {
+        'battle_number': str(battle_number),
+        'type': battle_type,
+        'start_time': 1600000000 + battle_number * 240,
+        'elapsed_time': 180,
+        'rule': {'key': key, 'name': name, 'multiline_name': name},
+        'game_mode': {'key': 'league_pair' if battle_type == 'league'
+                      else battle_type, 'name': battle_type.capitalize()},
+        'stage': {'id': '0', 'name': 'The Reef', 'image': '/images/stage/0.png'},
+        'my_team_result': {'key': 'victory' if victory else 'defeat',
+                           'name': 'VICTORY' if victory else 'DEFEAT'},
+        'other_team_result': {'key': 'defeat' if victory else 'victory',
+                              'name': 'DEFEAT' if victory else 'VICTORY'},
+        'my_team_percentage': rng.uniform(0, 100),
+        'other_team_percentage': rng.uniform(0, 100),
+        'my_estimate_league_point': rng.randint(1500, 2500),
+        'other_estimate_league_point': rng.randint(1500, 2500),
+        'max_league_point': rng.randint(0, 2500),
+        'estimate_gachi_power': rng.randint(1500, 2500),
+        'player_rank': rng.randint(1, 99),
+        'star_rank': 0,
+        'weapon_paint_point': rng.randint(0, 100000),
+        'player_result': member(rng, 'self0000000000ff'),
+    }
+
+    if detail:
+        data['my_team_members'] = [member(rng, f'{rng.getrandbits(64):016x}')
+                                   for _ in range(3)]
+        data['other_team_members'] = [member(rng, f'{rng.getrandbits(64):016x}')
+                                      for _ in range(4)]
+
+    return data
+
+
+def results(seed=0, count=50):
+    rng = random.Random(seed)
+    return {
+        'unique_id': '0123456789',
+        'summary': {'victory_count': 26,
+                    'defeat_count': 24,
+                    'victory_rate': 0.52,
+                    'kill_count_average': 6.2,
+                    'death_count_average': 5.1,
+                    'assist_count_average': 1.8,
+                    'special_count_average': 3.3,
+                    'count': count},
+        'results': [battle(rng, 5000 - i) for i in range(count)],
+    }
+
+
+def battle_detail(seed=0, battle_number=5000):
+    return battle(random.Random(seed), battle_number, detail=True)
+
+
+def records(seed=0):
+    rng = random.Random(seed)
+
+    def medals():
+        return {'gold_count': rng.randint(0, 50),
+                'silver_count': rng.randint(0, 50),
+                'bronze_count': rng.randint(0, 50),
+                'no_medal_count': rng.randint(0, 50)}
+
+    p = player(rng, 'self0000000000ff')
+    for rule in ('zones', 'tower', 'rainmaker', 'clam'):
+        p[f'udemae_{rule}'] = {'name': rng.choice(RANKS), 's_plus_number': None}
+    p['max_league_point_pair'] = 2100.5
+    p['max_league_point_team'] = 2300.1
+
+    return {
+        'records': {
+            'unique_id': '0123456789',
+            'player': p,
+            'league_stats': {'pair': medals(), 'team': medals()},
+            'recent_win_count': 26,
+            'recent_lose_count': 24,
+            'recent_disconnect_count': 0,
+            'win_count': 3000,
+            'lose_count': 2500,
+            'start_time': 1500000000,
+            'update_time': 1600000000,
+            'stage_stats': {str(i): {'stage': {'id': str(i), 'name': f'Stage {i}'},
+                                     'zones_win': rng.randint(0, 99),
+                                     'zones_lose': rng.randint(0, 99)}
+                            for i in range(23)},
+            'weapon_stats': {str(i): {'weapon': {'id': str(i),
+                                                 'name': rng.choice(WEAPONS)},
+                                      'win_count': rng.randint(0, 999),
+                                      'lose_count': rng.randint(0, 999)}
+                             for i in range(120)},
+        }
+    }
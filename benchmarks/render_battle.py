@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Render 10k recorded battles like /last does, like a push does, once per
+# battle, and then once for each of four viewers sharing the battle.
+#
+# Run from the repository root:
+#   python -m benchmarks.render_battle [battles]
+import json
+import sys
+import time
+
+from benchmarks import payloads
+from sp2bot import message
+from sp2bot.splatoon2models import SP2BattleResult
+
+
+class Viewer:
+
+    def __init__(self, principal_id):
+        self.principal_id = principal_id
+
+
+def render(battles, viewers, cache=True):
+    message._member_lines.clear()
+    started = time.perf_counter()
+    for battle in battles:
+        for viewer in viewers:
+            message._battle_result_msg(battle, viewer, cache=cache)
+    return time.perf_counter() - started
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    battles = [SP2BattleResult.de_json(json.loads(json.dumps(
+        payloads.battle_detail(seed=i, battle_number=i))))
+        for i in range(count)]
+
+    single = [Viewer('self0000000000ff')]
+    shared = [Viewer(f'{i:016x}') for i in range(4)]
+    for name, viewers, cache in (('uncached', single, False),
+                                 ('single', single, True),
+                                 ('shared x4', shared, True)):
+        elapsed = render(battles, viewers, cache)
+        renders = count * len(viewers)
+        print(f'{name:>9}: {renders} renders, '
+              f'{elapsed / renders * 1e6:.1f} us/render')
+
+
+if __name__ == '__main__':
+    main()
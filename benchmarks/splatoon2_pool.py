@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Compare a new urllib3 pool per Splatoon2 instance with the shared
+# keep-alive pool against a local stub server.
+#
+# Run from the repository root:
+#   python -m benchmarks.splatoon2_pool [requests] [threads]
+import json
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import telegram.vendor.ptb_urllib3.urllib3 as urllib3
+
+from sp2bot import splatoon2
+from sp2bot.splatoon2 import Splatoon2
+
+BODY = json.dumps({'records': {'unique_id': '0', 'player': {}}}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super(StubServer, self).__init__(('127.0.0.1', 0), StubHandler)
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def get_request(self):
+        request = super(StubServer, self).get_request()
+        with self._lock:
+            self.connections += 1
+        return request
+
+
+def per_instance_pool(session):
+    # Behaviour before the shared pool
+    client = Splatoon2(session)
+    client._con_pool = urllib3.PoolManager(num_pools=50)
+    return client
+
+
+def shared_pool(session):
+    return Splatoon2(session)
+
+
+def run(server, make_client, count, threads):
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    def call(i):
+        client = make_client(f'session{i}')
+        client._base_url = base_url
+        started = time.perf_counter()
+        client.get('/api/records')
+        return time.perf_counter() - started
+
+    server.connections = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = sorted(executor.map(call, range(count)))
+
+    return {
+        'connections': server.connections,
+        'p50_ms': round(statistics.median(latencies) * 1000, 3),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    server = StubServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Plain http for the stub server
+    splatoon2._con_pool = urllib3.PoolManager(
+        maxsize=threads, block=True)
+
+    for name, make_client in (('per-instance pool', per_instance_pool),
+                              ('shared pool', shared_pool)):
+        print(f'{name:>18}: {run(server, make_client, count, threads)}')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,10 @@ DATABASE_URI = os.environ.get('DATABASE_URL')
 if DATABASE_URI and DATABASE_URI.startswith("postgres://"):
     DATABASE_URI = DATABASE_URI.replace("postgres://", "postgresql://", 1)
 
+# Max users cached in memory.
+# Default is 10000.
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+
 # Webhook
 # Enable webhook mode.
 # Default is false.
@@ -34,3 +38,106 @@ WEBHOOK_PORT = os.environ.get('WEBHOOK_PORT', 5000)
 
 # Webhook port
 WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+
+# Max connections Telegram opens to deliver updates to the webhook.
+# Default is 40.
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', 40))
+
+# Handlers
+# Worker threads running handlers that call the Nintendo API.
+# Default is 8.
+HANDLER_WORKERS = int(os.environ.get('HANDLER_WORKERS', 8))
+
+# Max updates waiting for or running on a handler worker, more are
+# answered with a busy message.
+# Default is 100.
+HANDLER_MAX_PENDING = int(os.environ.get('HANDLER_MAX_PENDING', 100))
+
+# Metrics
+# Serve Prometheus text metrics on http://METRICS_LISTEN:METRICS_PORT/metrics.
+# Default is disabled.
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+METRICS_LISTEN = os.environ.get('METRICS_LISTEN', '127.0.0.1')
+
+# Battle push
+# Seconds between two battle polls of the same user.
+# Default is 10.
+BATTLE_PUSH_INTERVAL = int(os.environ.get('BATTLE_PUSH_INTERVAL', 10))
+
+# Poll interval backs off exponentially after this many polls without
+# a new battle, up to BATTLE_PUSH_MAX_INTERVAL seconds.
+# Default is 30 polls and 300 seconds.
+BATTLE_PUSH_BACKOFF_AFTER = int(os.environ.get('BATTLE_PUSH_BACKOFF_AFTER', 30))
+BATTLE_PUSH_MAX_INTERVAL = int(os.environ.get('BATTLE_PUSH_MAX_INTERVAL', 300))
+
+# Seconds between two writes of changed battle polls to database.
+# Default is 30.
+BATTLE_POLL_FLUSH_INTERVAL = int(os.environ.get('BATTLE_POLL_FLUSH_INTERVAL', 30))
+
+# Max battle polls per second for all users together.
+# Default is 20.
+BATTLE_PUSH_MAX_RATE = int(os.environ.get('BATTLE_PUSH_MAX_RATE', 20))
+
+# Worker threads fetching battles.
+# Default is 8.
+BATTLE_PUSH_WORKERS = int(os.environ.get('BATTLE_PUSH_WORKERS', 8))
+
+# Battle history backfill
+# Battle details fetched at the same time.
+# Default is 4.
+BACKFILL_CONCURRENCY = int(os.environ.get('BACKFILL_CONCURRENCY', 4))
+
+# Session keep-alive
+# Every session is checked once per KEEP_ALIVE_INTERVAL seconds, in slices
+# run every KEEP_ALIVE_SLICE_INTERVAL seconds.
+# Default is 21600 and 60 seconds.
+KEEP_ALIVE_INTERVAL = int(os.environ.get('KEEP_ALIVE_INTERVAL', 21600))
+KEEP_ALIVE_SLICE_INTERVAL = int(os.environ.get('KEEP_ALIVE_SLICE_INTERVAL', 60))
+
+# Sessions checked at the same time, and users loaded per query.
+# Default is 8 and 500.
+KEEP_ALIVE_CONCURRENCY = int(os.environ.get('KEEP_ALIVE_CONCURRENCY', 8))
+KEEP_ALIVE_PAGE_SIZE = int(os.environ.get('KEEP_ALIVE_PAGE_SIZE', 500))
+
+# Sessions with a successful Splatoon2 API response in the last
+# KEEP_ALIVE_FRESH_FOR seconds are not checked.
+# Default is 10800.
+KEEP_ALIVE_FRESH_FOR = int(os.environ.get('KEEP_ALIVE_FRESH_FOR', 10800))
+
+# Splatoon2 API
+# Max keep-alive connections to app.splatoon2.nintendo.net shared by all
+# users, requests wait for a free connection when all are busy.
+# Default is 16.
+SPLATOON2_POOL_MAXSIZE = int(os.environ.get('SPLATOON2_POOL_MAXSIZE', 16))
+
+# Seconds a session's /api/records response is reused, 0 disables it.
+# Default is 60.
+RECORDS_CACHE_TTL = int(os.environ.get('RECORDS_CACHE_TTL', 60))
+
+# Nintendo login
+# Where PKCE code verifiers wait for the pasted login link: memory, or sql
+# to share them between bot processes on the same database.
+# Default is memory.
+AUTH_VERIFIER_STORE = os.environ.get('AUTH_VERIFIER_STORE', 'memory')
+
+# Seconds a login link from /gettoken stays valid.
+# Default is 600.
+AUTH_VERIFIER_TTL = int(os.environ.get('AUTH_VERIFIER_TTL', 600))
+
+# League medals
+# Seconds between tries while a finished League rotation's medal is not
+# published yet, and seconds after the rotation to stop trying.
+# Default is 300 and 3600.
+MEDAL_RETRY_INTERVAL = int(os.environ.get('MEDAL_RETRY_INTERVAL', 300))
+MEDAL_GIVE_UP_AFTER = int(os.environ.get('MEDAL_GIVE_UP_AFTER', 3600))
+
+# Battle cache
+# Max battles kept in memory and their max total size in bytes.
+# Default is 2048 battles and 64MB.
+BATTLE_CACHE_SIZE = int(os.environ.get('BATTLE_CACHE_SIZE', 2048))
+BATTLE_CACHE_MAX_BYTES = int(os.environ.get('BATTLE_CACHE_MAX_BYTES',
+                                            64 * 1024 * 1024))
+
+# Also keep cached battles in the database.
+# Default is false.
+BATTLE_CACHE_DISK = os.environ.get('BATTLE_CACHE_DISK', False)
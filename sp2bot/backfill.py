@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from sp2bot import store
+from sp2bot.splatoon2 import Splatoon2, Splatoon2SessionInvalid
+from sp2bot.utils.model import Model
+
+
+class BackfillReport(Model):
+
+    def __init__(self,
+                 users=0,
+                 listed=0,
+                 skipped=0,
+                 inserted=0,
+                 failed=0,
+                 elapsed=0.0,
+                 last_user_id=None):
+        self.users = users
+        self.listed = listed
+        self.skipped = skipped
+        self.inserted = inserted
+        self.failed = failed
+        self.elapsed = elapsed
+        self.last_user_id = last_user_id
+
+    @property
+    def battles_per_second(self):
+        return self.inserted / self.elapsed if self.elapsed else 0.0
+
+    def add(self, report):
+        self.users += report.users
+        self.listed += report.listed
+        self.skipped += report.skipped
+        self.inserted += report.inserted
+        self.failed += report.failed
+        self.elapsed += report.elapsed
+        self.last_user_id = report.last_user_id
+
+    def __str__(self):
+        return f'users: {self.users}, listed: {self.listed}, ' \
+               f'skipped: {self.skipped}, inserted: {self.inserted}, ' \
+               f'failed: {self.failed}, {self.elapsed:.1f}s, ' \
+               f'{self.battles_per_second:.1f} battles/s'
+
+
+class Backfill:
+    """Imports the recent battles of users into the battle tables.
+
+    Battles already stored are skipped, so a run that stopped half way
+    resumes by running again.
+    """
+
+    def __init__(self, concurrency=4):
+        self._executor = ThreadPoolExecutor(max_workers=concurrency,
+                                            thread_name_prefix='backfill')
+        # Users are imported one at a time
+        self._user_executor = ThreadPoolExecutor(max_workers=1)
+
+    def submit(self, user):
+        def done(future):
+            try:
+                print(f'Backfill {user.id}: {future.result()}')
+            except Exception as e:
+                print(f'Exception, backfill {user.id}: {e}')
+
+        future = self._user_executor.submit(self.run, user)
+        future.add_done_callback(done)
+        return future
+
+    def run(self, user):
+        started = time.monotonic()
+        report = BackfillReport(users=1, last_user_id=user.id)
+
+        splatoon2 = Splatoon2.for_user(user)
+        try:
+            overview = splatoon2.get_battle_overview()
+        except Splatoon2SessionInvalid:
+            return report
+        except Exception as e:
+            print(f'Exception, backfill {user.id}: {e}')
+            report.failed = 1
+            report.elapsed = time.monotonic() - started
+            return report
+        battle_numbers = [b.battle_number for b in overview.results]
+
+        stored = store.select_battle_numbers(user.id, battle_numbers)
+        missing = [n for n in battle_numbers if str(n) not in stored]
+        report.listed = len(battle_numbers)
+        report.skipped = len(battle_numbers) - len(missing)
+
+        battles = []
+        # Kept out of the battle cache, the push loop and /last use it
+        futures = [self._executor.submit(splatoon2.get_battle, n, False)
+                   for n in missing]
+        for future in as_completed(futures):
+            try:
+                battles.append(future.result())
+            except Exception as e:
+                report.failed += 1
+                print(f'Exception, backfill {user.id}: {e}')
+
+        # Oldest first, in one transaction
+        battles.sort(key=lambda b: int(b.battle_number))
+        report.inserted = store.insert_battles(user.id, battles)
+        report.elapsed = time.monotonic() - started
+
+        return report
+
+    def run_all(self, after_user_id=None):
+        report = BackfillReport(last_user_id=after_user_id)
+
+        for user in store.select_all_users():
+            if after_user_id is not None and user.id <= after_user_id:
+                continue
+            if not user.iksm_session:
+                continue
+
+            try:
+                report.add(self.run(user))
+            except Exception as e:
+                print(f'Exception, backfill {user.id}: {e}')
+                report.last_user_id = user.id
+
+            print(f'Backfill: {report}')
+
+        return report
+
+    def shutdown(self):
+        self._user_executor.shutdown(wait=False)
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+from collections import OrderedDict
+
+import configs
+from sp2bot import store
+from sp2bot.splatoon2models import SP2BattleResult
+from sp2bot.utils import jsoncodec
+
+
+class BattleCache:
+    """Finished battles never change, so they are cached by
+    (principal_id, battle_number) in a size bounded LRU, optionally backed
+    by the battle_cache table."""
+
+    def __init__(self, max_entries=2048, max_bytes=64 * 1024 * 1024,
+                 disk=False):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk = disk
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def get(self, principal_id, battle_number):
+        key = (principal_id, str(battle_number))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        if self.disk:
+            raw = store.select_cached_battle(*key)
+            if raw:
+                battle = SP2BattleResult.de_json(jsoncodec.loads(raw))
+                self._put(key, battle, len(raw))
+                with self._lock:
+                    self.disk_hits += 1
+                return battle
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, principal_id, battle_number, battle, raw):
+        key = (principal_id, str(battle_number))
+        self._put(key, battle, len(raw))
+
+        if self.disk:
+            store.insert_cached_battle(*key, raw.decode('utf-8'))
+
+    def _put(self, key, battle, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._bytes -= old[1]
+
+            self._entries[key] = (battle, size)
+            self._bytes += size
+
+            while self._entries and \
+                    (len(self._entries) > self.max_entries or
+                     self._bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+
+battle_cache = BattleCache(max_entries=configs.BATTLE_CACHE_SIZE,
+                           max_bytes=configs.BATTLE_CACHE_MAX_BYTES,
+                           disk=configs.BATTLE_CACHE_DISK)
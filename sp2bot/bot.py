@@ -7,8 +7,13 @@ from threading import Thread
 from telegram.ext import Updater, CommandHandler, Filters, CallbackQueryHandler
 
 import configs
+from sp2bot import metrics
+from sp2bot.battlecache import battle_cache
 from sp2bot.controller import Controller
+from sp2bot.dispatch import Dispatch
+from sp2bot.sender import sender
 from sp2bot.tasks import Task
+from sp2bot.utils.type import try_to_int
 import logging
 
 if configs.DEBUG:
@@ -29,9 +34,15 @@ class Bot:
         updater = Updater(token, use_context=True)
         dp = updater.dispatcher
 
+        # Outbound message queue
+        sender.start(updater.bot)
+
         # Stop handle
         def stop_and_restart():
             updater.stop()
+            dispatch.shutdown()
+            task.shutdown()
+            sender.stop()
             os.execl(sys.executable, sys.executable, *sys.argv)
 
         # Restart handle
@@ -39,16 +50,51 @@ class Bot:
             update.message.reply_text('Bot is restarting...')
             Thread(target=stop_and_restart).start()
 
+        # Import battle history of all users
+        def backfill(update, context):
+            after_user_id = try_to_int(context.args[0]) \
+                if context.args else None
+            update.message.reply_text('Backfill started.')
+
+            def run():
+                chat_id = update.effective_chat.id
+                try:
+                    report = task.backfill_all(after_user_id)
+                    sender.send_message(chat_id,
+                                        f'Backfill finished.\n{report}')
+                except Exception as e:
+                    print(f'Exception, backfill: {e}')
+                    sender.send_message(chat_id, f'Backfill failed: {e}')
+
+            Thread(target=run).start()
+
+        # Handler latencies and backlog
+        def stats(update, context):
+            lines = [f'pending: {dispatch.pending}, '
+                     f'rejected: {dispatch.rejected}']
+            for name, histogram in sorted(dispatch.latencies.items()):
+                latency = histogram.stats
+                lines.append(f'{name}: {latency["count"]}, '
+                             f'avg {latency["avg"]:.3f}s, '
+                             f'p50 {latency["p50"]}s, p99 {latency["p99"]}s')
+            update.message.reply_text('\n'.join(lines))
+
         # Stop sig handler
         def user_sig_handler(signum, frame):
+            dispatch.shutdown()
+            task.shutdown()
+            sender.stop()
             print('Stopped')
-            pass
 
         updater.user_sig_handler = user_sig_handler
 
         # Create Task
         task = Task()
 
+        # Handlers calling the Nintendo API run on the worker pool
+        dispatch = Dispatch(workers=configs.HANDLER_WORKERS,
+                            max_pending=configs.HANDLER_MAX_PENDING)
+
         # Set handlers
         controller = Controller(task)
 
@@ -57,34 +103,87 @@ class Bot:
                                       filters=Filters.user(
                                           username=configs.ADMINISTRATOR_USERNAME
                                       )))
-        dp.add_handler(CommandHandler('start', controller.start))
-        dp.add_handler(CommandHandler('gettoken', controller.get_token))
-        dp.add_handler(
-            CommandHandler('settoken', controller.generate_iksm_and_set))
-        dp.add_handler(CommandHandler('setsession', controller.set_session))
-        dp.add_handler(CommandHandler('last', controller.last))
-        dp.add_handler(CommandHandler('last50', controller.last50))
+        dp.add_handler(CommandHandler('backfill',
+                                      backfill,
+                                      filters=Filters.user(
+                                          username=configs.ADMINISTRATOR_USERNAME
+                                      )))
+        dp.add_handler(CommandHandler('stats',
+                                      stats,
+                                      filters=Filters.user(
+                                          username=configs.ADMINISTRATOR_USERNAME
+                                      )))
+        dp.add_handler(CommandHandler('start',
+                                      dispatch.fast('start',
+                                                    controller.start)))
+        dp.add_handler(CommandHandler('gettoken',
+                                      dispatch.slow('gettoken',
+                                                    controller.get_token)))
+        dp.add_handler(CommandHandler('settoken',
+                                      dispatch.slow('settoken',
+                                                    controller.generate_iksm_and_set)))
+        dp.add_handler(CommandHandler('setsession',
+                                      dispatch.slow('setsession',
+                                                    controller.set_session)))
+        dp.add_handler(CommandHandler('last',
+                                      dispatch.slow('last',
+                                                    controller.last)))
+        dp.add_handler(CommandHandler('last50',
+                                      dispatch.slow('last50',
+                                                    controller.last50)))
         dp.add_handler(CommandHandler('pushhere',
-                                      controller.start_push,
+                                      dispatch.slow('pushhere',
+                                                    controller.start_push),
                                       pass_job_queue=True))
         dp.add_handler(CommandHandler('startpush',
-                                      controller.start_push,
+                                      dispatch.slow('startpush',
+                                                    controller.start_push),
                                       pass_job_queue=True))
-        dp.add_handler(CommandHandler('stoppush', controller.stop_push))
-        dp.add_handler(CommandHandler('resetpush', controller.reset_push))
-        dp.add_handler(CommandHandler('help', controller.help))
-        dp.add_handler(CommandHandler('me', controller.get_user_info))
-        dp.add_handler(CallbackQueryHandler(controller.menu_actions))
+        dp.add_handler(CommandHandler('stoppush',
+                                      dispatch.slow('stoppush',
+                                                    controller.stop_push)))
+        dp.add_handler(CommandHandler('resetpush',
+                                      dispatch.slow('resetpush',
+                                                    controller.reset_push)))
+        dp.add_handler(CommandHandler('help',
+                                      dispatch.fast('help',
+                                                    controller.help)))
+        dp.add_handler(CommandHandler('me',
+                                      dispatch.slow('me',
+                                                    controller.get_user_info)))
+        dp.add_handler(CallbackQueryHandler(
+            dispatch.slow('menu', controller.menu_actions)))
 
         # Set task job
         task.job_queue = updater.job_queue
 
+        # Run battle poll scheduler
+        task.start_battle_poll_task()
+
         # Run jobs in database
         task.load_and_run_all_push_job()
 
+        # Write changed battle polls to database
+        task.start_battle_poll_flush_task()
+
         # Run keep-alive jobs
         task.start_all_user_keep_alive_task()
 
+        # Metrics
+        metrics.register_gauges('sender', lambda: sender.stats)
+        metrics.register_gauges('battle_cache', lambda: battle_cache.stats)
+        metrics.register_gauges('dispatch', lambda: dispatch.stats)
+        metrics.register_gauges('keep_alive', lambda: task.keep_alive_stats)
+        metrics.register_gauges('medals', lambda: task.medal_stats)
+        metrics.register_gauges('shared_battles',
+                                lambda: task.shared_battle_stats)
+        metrics.register_gauges('push', lambda: dict(
+            task.poll_metrics.to_dict() if task.poll_metrics else {},
+            active=task.push_job_count))
+        if configs.METRICS_PORT:
+            metrics.start_exporter(configs.METRICS_PORT,
+                                   configs.METRICS_LISTEN)
+
         # Launch
         if configs.WEBHOOK_MODE:
             updater.start_webhook(
@@ -93,7 +192,8 @@ class Bot:
                 url_path=configs.WEBHOOK_URL
             )
             updater.bot.setWebhook(
-                configs.WEBHOOK_URL + '/' + configs.TELEGRAM_BOT_TOKEN
+                configs.WEBHOOK_URL + '/' + configs.TELEGRAM_BOT_TOKEN,
+                max_connections=configs.WEBHOOK_MAX_CONNECTIONS
             )
         else:
             updater.start_polling()
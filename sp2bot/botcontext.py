@@ -1,10 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from telegram import Update
-from telegram.error import BadRequest
 
 from sp2bot import store
 from sp2bot.models import User
+from sp2bot.sender import sender
+
+# Seconds a handler waits for a message id it needs
+SEND_WAIT_TIMEOUT = 10
 
 
 class BotContext:
@@ -58,7 +61,8 @@ class BotContext:
     def args(self):
         return self.telegram_context.args
 
-    def send_message(self, message, chat_id=None):
+    # Queued without waiting, with wait=True the sent message_id or None
+    def send_message(self, message, chat_id=None, wait=False):
         if not chat_id:
             chat_id = self.chat_id
 
@@ -68,13 +72,16 @@ class BotContext:
         else:
             (content, message_type) = message
         parse_mode = message_type if message_type else None
+        # Falls back to plain text on BadRequest
+        future = sender.send_message(chat_id, content, parse_mode=parse_mode)
+        if not wait:
+            return future
+
         try:
-            return self.bot.send_message(chat_id,
-                                  content,
-                                  parse_mode=parse_mode).message_id
-        except BadRequest as e:
-            # Resend
-            return self.bot.send_message(chat_id, content).message_id
+            return future.result(timeout=SEND_WAIT_TIMEOUT).message_id
+        except Exception as e:
+            print(f'Exception, send_message wait: {e}')
+            return None
 
     def edit_message(self, message, message_id, chat_id=None):
         if not chat_id:
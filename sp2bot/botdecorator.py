@@ -1,37 +1,58 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from sp2bot import store
+import time
+from contextlib import contextmanager
+
+from sp2bot import metrics, store
 from sp2bot.botcontext import BotContext
 from sp2bot.message import Message
 from sp2bot.splatoon2 import Splatoon2
 
 
+@contextmanager
+def _measure(name):
+    # Handler time and outcome, the stages inside are timed where they run
+    started = time.monotonic()
+    result = 'error'
+    try:
+        yield
+        result = 'ok'
+    finally:
+        metrics.observe('handler_seconds', time.monotonic() - started,
+                        handler=name)
+        metrics.inc('handler_total', handler=name, result=result)
+
+
 def check_session_handler(func):
     def wrapper(self, update, context, **optional_args):
         if not update.message:
             return
 
-        bot_context = BotContext(update, context)
-        user = bot_context.user
-        if user and user.iksm_session:
+        with _measure(func.__name__):
+            bot_context = BotContext(update, context)
+            user = bot_context.user
+            if user and user.iksm_session:
 
-            if not user.sp2_user:
-                sp2_user = Splatoon2(user.iksm_session).get_user()
-                if not sp2_user:
-                    bot_context.send_message(
-                        Message(bot_context).session_invalid)
-                    return
+                if not user.sp2_user:
+                    sp2_user = Splatoon2(user.iksm_session).get_user()
+                    if not sp2_user:
+                        metrics.inc('session_invalid_total',
+                                    handler=func.__name__)
+                        bot_context.send_message(
+                            Message(bot_context).session_invalid)
+                        return
 
-                user.sp2_user = sp2_user.player
+                    user.sp2_user = sp2_user.player
 
-            store.update_user(user)
+                store.update_user(user)
 
-            if optional_args:
-                return func(self, bot_context, **optional_args)
+                if optional_args:
+                    return func(self, bot_context, **optional_args)
+                else:
+                    return func(self, bot_context)
             else:
-                return func(self, bot_context)
-        else:
-            bot_context.send_message(Message(bot_context).session_invalid)
+                metrics.inc('session_invalid_total', handler=func.__name__)
+                bot_context.send_message(Message(bot_context).session_invalid)
 
     return wrapper
 
@@ -41,8 +62,9 @@ def handler(func):
         if not update.message:
             return
 
-        bot_context = BotContext(update, context)
-        store.update_user(bot_context.user)
-        return func(self, bot_context)
+        with _measure(func.__name__):
+            bot_context = BotContext(update, context)
+            store.update_user(bot_context.user)
+            return func(self, bot_context)
 
     return wrapper
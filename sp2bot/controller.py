@@ -44,7 +44,8 @@ class Controller:
             return
 
         token_data = context.args[0]
-        wait_message_id = context.send_message(message.generate_iksm_wait)
+        wait_message_id = context.send_message(message.generate_iksm_wait,
+                                               wait=True)
 
         session_token_code = re.search('de=(.*)&', token_data)
         session_token = Splatoon2Auth().get_session_token(context.user.id,
@@ -117,7 +118,10 @@ class Controller:
     def last(self, context):
         args = context.args
         message = Message(context)
-        splatoon2 = Splatoon2(context.user.iksm_session)
+        splatoon2 = Splatoon2.for_user(context.user)
+
+        # User is playing, poll at the fast rate again
+        self._task.wake_push(context.user.id)
 
         if len(args) > 0:
             index = try_to_int(args[0])
@@ -159,7 +163,14 @@ class Controller:
             context.send_message(message.session_invalid)
             return
 
-        context.send_message(message.last50_overview(battle_overview))
+        # Every battle stored since push started, beyond Nintendo's 50
+        try:
+            history = store.select_battle_stats(context.user.id)
+        except Exception as e:
+            print(f'Exception, select_battle_stats: {e}')
+            history = None
+
+        context.send_message(message.last50_overview(battle_overview, history))
 
     @check_session_handler
     def start_push(self, context):
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sp2bot import metrics
+from sp2bot.metrics import Histogram
+from sp2bot.sender import sender
+
+BUSY_MESSAGE = 'The bot is busy, please try again later.'
+
+
+class Dispatch:
+    """Routes handlers that call the Nintendo API to a sized worker pool,
+    so one slow login does not hold up every other user. Fast handlers
+    run inline on the dispatcher thread.
+
+    At most `max_pending` slow updates wait or run at once, more are
+    answered with a busy message instead of piling up.
+    """
+
+    def __init__(self, workers=8, max_pending=100):
+        self.max_pending = max_pending
+
+        self.rejected = 0
+        self.latencies = {}
+
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='handler')
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @property
+    def stats(self):
+        return {
+            'pending': self._pending,
+            'rejected': self.rejected,
+            'handlers': {name: histogram.stats
+                         for name, histogram in self.latencies.items()},
+        }
+
+    def fast(self, name, callback):
+        histogram = self._histogram(name)
+
+        def run(update, context):
+            started = time.monotonic()
+            try:
+                return callback(update, context)
+            finally:
+                elapsed = time.monotonic() - started
+                histogram.observe(elapsed)
+                metrics.observe('update_seconds', elapsed, handler=name)
+
+        return run
+
+    def slow(self, name, callback):
+        histogram = self._histogram(name)
+
+        def run(update, context, queued_at):
+            try:
+                callback(update, context)
+            except Exception as e:
+                print(f'Exception, {name}: {e}')
+            finally:
+                # Time in the backlog counts, the user waited for it too
+                elapsed = time.monotonic() - queued_at
+                histogram.observe(elapsed)
+                metrics.observe('update_seconds', elapsed, handler=name)
+                with self._lock:
+                    self._pending -= 1
+
+        def submit(update, context):
+            with self._lock:
+                if self._pending >= self.max_pending:
+                    self.rejected += 1
+                    metrics.inc('update_rejected_total', handler=name)
+                    busy = True
+                else:
+                    self._pending += 1
+                    busy = False
+
+            if busy:
+                if update.effective_chat:
+                    sender.send_message(update.effective_chat.id,
+                                        BUSY_MESSAGE)
+                return
+
+            try:
+                self._executor.submit(run, update, context, time.monotonic())
+            except RuntimeError:
+                # Shutting down
+                with self._lock:
+                    self._pending -= 1
+
+        return submit
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _histogram(self, name):
+        if name not in self.latencies:
+            self.latencies[name] = Histogram()
+        return self.latencies[name]
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class SharedBattles:
+    """Friends pushing into one group chat often play the same battle.
+
+    The first pusher to see a battle claims it by (chat_id, start_time),
+    fetches it once and posts one message for everyone. The others learn
+    from the claim who played in it and, if they did, only update their
+    own statistics. Nobody waits for a claim, until it is resolved the
+    others leave the battle for their next poll, for at most `timeout`
+    seconds.
+    """
+
+    def __init__(self, max_entries=1024, timeout=30):
+        self.max_entries = max_entries
+        self.timeout = timeout
+
+        self.claimed = 0
+        self.shared = 0
+        self.timeouts = 0
+
+        self._claims = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        return {
+            'claims': len(self._claims),
+            'claimed': self.claimed,
+            'shared': self.shared,
+            'timeouts': self.timeouts,
+        }
+
+    # A Future the caller must resolve with the principal_ids of the
+    # battle's players, or None when another pusher already claimed it
+    def claim(self, chat_id, start_time):
+        key = (chat_id, start_time)
+        with self._lock:
+            if key in self._claims:
+                return None
+
+            claim = Future()
+            self._claims[key] = (claim, time.monotonic())
+            if len(self._claims) > self.max_entries:
+                self._claims.popitem(last=False)
+            self.claimed += 1
+            return claim
+
+    # True when the battle at start_time was claimed for the chat and
+    # principal_id played in it, None while the claim is not resolved
+    def played_in_claimed(self, chat_id, start_time, principal_id):
+        with self._lock:
+            entry = self._claims.get((chat_id, start_time))
+        if not entry:
+            return False
+
+        claim, claimed_at = entry
+        if not claim.done():
+            if time.monotonic() - claimed_at < self.timeout:
+                return None
+            self.timeouts += 1
+            return False
+
+        try:
+            principal_ids = claim.result()
+        except Exception:
+            return False
+
+        if principal_id not in principal_ids:
+            return False
+        self.shared += 1
+        return True
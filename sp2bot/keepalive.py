@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sp2bot import store
+from sp2bot.splatoon2 import Splatoon2, Splatoon2SessionInvalid, \
+    last_contact
+from sp2bot.utils.model import Model
+
+
+class KeepAliveReport(Model):
+
+    def __init__(self,
+                 checked=0,
+                 skipped=0,
+                 invalidated=0,
+                 failed=0,
+                 elapsed=0.0):
+        self.checked = checked
+        self.skipped = skipped
+        self.invalidated = invalidated
+        self.failed = failed
+        self.elapsed = elapsed
+
+    def __str__(self):
+        return f'checked: {self.checked}, skipped: {self.skipped}, ' \
+               f'invalidated: {self.invalidated}, ' \
+               f'failed: {self.failed}, {self.elapsed:.1f}s'
+
+
+class KeepAlive:
+    """Checks every session once per `period` seconds so it does not expire.
+
+    A sweep is cut into slices, one every `slice_interval` seconds, each
+    checking the next users by id on a bounded pool. The load spreads over
+    the whole period instead of bursting when the bot starts. Sessions
+    with a successful response in the last `fresh_for` seconds, e.g. from
+    the push loop, are skipped.
+    """
+
+    def __init__(self, period=21600, slice_interval=60, concurrency=8,
+                 page_size=500, fresh_for=10800):
+        self.period = period
+        self.fresh_for = fresh_for
+        self.slice_interval = slice_interval
+        self.page_size = page_size
+
+        self.sweeps = 0
+        self.checked = 0
+        self.skipped = 0
+
+        self._after_user_id = 0
+        self._slice_size = 0
+        self._sweep_started = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency,
+                                            thread_name_prefix='keep_alive')
+        # Slices never overlap
+        self._slice_executor = ThreadPoolExecutor(max_workers=1)
+
+    @property
+    def stats(self):
+        return {
+            'sweeps': self.sweeps,
+            'checked': self.checked,
+            'skipped': self.skipped,
+        }
+
+    def submit(self):
+        return self._slice_executor.submit(self.run_slice)
+
+    def run_slice(self):
+        started = time.monotonic()
+        report = KeepAliveReport()
+
+        with self._lock:
+            if self._after_user_id == 0 and not self._start_sweep(started):
+                return report
+
+            invalid = {}
+            remaining = self._slice_size
+            while remaining > 0:
+                users = store.select_users_with_session(
+                    self._after_user_id, min(self.page_size, remaining))
+                if not users:
+                    # Sweep done
+                    self._after_user_id = 0
+                    self.sweeps += 1
+                    break
+
+                self._after_user_id = users[-1].id
+                remaining -= len(users)
+                invalid.update(self._check(users, report))
+
+            # One UPDATE for the whole slice
+            report.invalidated = store.invalidate_sessions(invalid)
+
+        report.elapsed = time.monotonic() - started
+        return report
+
+    def shutdown(self):
+        self._slice_executor.shutdown(wait=False)
+        self._executor.shutdown(wait=False)
+
+    def _start_sweep(self, now):
+        # Wait for the period to end when the last sweep finished early
+        if self._sweep_started is not None and \
+                now - self._sweep_started < self.period:
+            return False
+
+        slices = max(1, self.period // self.slice_interval)
+        self._slice_size = math.ceil(store.count_users_with_session() / slices)
+        if not self._slice_size:
+            return False
+
+        self._sweep_started = now
+        return True
+
+    def _check(self, users, report):
+        now = time.monotonic()
+        idle = []
+        for user in users:
+            contact = last_contact(user.iksm_session)
+            if contact is not None and now - contact < self.fresh_for:
+                report.skipped += 1
+            else:
+                idle.append(user)
+        self.skipped += len(users) - len(idle)
+        self.checked += len(idle)
+
+        invalid = {}
+        for user, alive in zip(idle, self._executor.map(_alive, idle)):
+            report.checked += 1
+            if alive is None:
+                report.failed += 1
+            elif not alive:
+                invalid[user.id] = user.iksm_session
+        return invalid
+
+
+def _alive(user):
+    try:
+        _ = Splatoon2.for_user(user).get_battle_overview()
+        return True
+    except Splatoon2SessionInvalid:
+        return False
+    except:
+        return None
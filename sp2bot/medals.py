@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+
+from sp2bot import metrics
+from sp2bot.message import Message
+from sp2bot.splatoon2models import SP2LeagueMedals
+
+
+class MedalTracker:
+    """Tells a pusher about new League medals.
+
+    /api/records is only downloaded to take the first snapshot and once a
+    League battle's rotation is over, retried every `retry_interval`
+    seconds until Nintendo publishes the medal or `give_up_after` seconds
+    passed.
+    """
+
+    def __init__(self, retry_interval=300, give_up_after=3600):
+        self.retry_interval = retry_interval
+        self.give_up_after = give_up_after
+
+        self.refreshes = 0
+        self.changes = 0
+
+        # Next try of a pending refresh per user
+        self._retry_at = {}
+
+    @property
+    def stats(self):
+        return {
+            'refreshes': self.refreshes,
+            'changes': self.changes,
+            'pending': len(self._retry_at),
+        }
+
+    # Message content when the medals changed, otherwise None
+    def check(self, battle_poll, splatoon2):
+        now = time.time()
+        user_id = str(battle_poll.user.id)
+        has_snapshot = battle_poll.medals_pair is not None
+        due = bool(battle_poll.flag_medal) and \
+            now >= (battle_poll.medal_due_at or 0)
+
+        if has_snapshot and not due:
+            return None
+        if now < self._retry_at.get(user_id, 0):
+            return None
+
+        try:
+            self.refreshes += 1
+            metrics.inc('medal_refresh_total')
+            league_stats = splatoon2.get_records()['records']['league_stats']
+            pair = SP2LeagueMedals.de_json(league_stats['pair'])
+            team = SP2LeagueMedals.de_json(league_stats['team'])
+        except Exception as e:
+            print(f'Exception, medals {user_id}: {e}')
+            self._retry_at[user_id] = now + self.retry_interval
+            return None
+
+        old_pair, old_team = battle_poll.medals_pair, battle_poll.medals_team
+        if not has_snapshot or pair != old_pair or team != old_team:
+            battle_poll.medals_pair = pair
+            battle_poll.medals_team = team
+
+        if not has_snapshot:
+            self._retry_at.pop(user_id, None)
+            return None
+
+        if pair == old_pair and team == old_team:
+            # Not published yet. Without a due time, as in polls stored
+            # before it existed, one check is all it gets
+            due_at = battle_poll.medal_due_at
+            if due_at is not None and now - due_at < self.give_up_after:
+                self._retry_at[user_id] = now + self.retry_interval
+                return None
+            content = None
+        else:
+            self.changes += 1
+            content = Message.medal_changed(old_pair, pair, old_team, team)
+
+        self._retry_at.pop(user_id, None)
+        battle_poll.flag_medal = 0
+        battle_poll.medal_due_at = None
+        return content
+
+    def forget(self, user_id):
+        self._retry_at.pop(str(user_id), None)
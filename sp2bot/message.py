@@ -1,12 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import json
+import threading
+from collections import OrderedDict
 from datetime import datetime as dt
-from telegram.utils.helpers import escape_markdown
 
-from sp2bot import store
 from sp2bot.splatoon2models import SP2BattleResult, SP2BattleType, \
     SP2PlayerSpecies
+from sp2bot.utils.markup import escape_html, code, bold
 
 
 class MessageType:
@@ -20,11 +20,11 @@ class Message:
         self.context = context
 
     def login_url(self, url):
-        text = '1.Navigate to this URL in your *desktop* browser:\n'
-        text += f'[Click here to open the URL]({url})\n\n'
-        text += '2.Log in, *right click* the "Select this account" button, *copy the link address*, and type /settoken `[link_address]`.'
+        text = '1.Navigate to this URL in your <b>desktop</b> browser:\n'
+        text += f'<a href="{escape_html(url)}">Click here to open the URL</a>\n\n'
+        text += '2.Log in, <b>right click</b> the "Select this account" button, <b>copy the link address</b>, and type /settoken <code>[link_address]</code>.'
 
-        return text, MessageType.Markdown
+        return text, MessageType.HTML
 
     @property
     def generate_iksm_wait(self):
@@ -42,14 +42,14 @@ class Message:
 
     @property
     def session_invalid(self):
-        text = 'The `token` is invalid.\n'
+        text = 'The <code>token</code> is invalid.\n'
         if self.context.chat.type != 'private':
             text += 'To reset, send /gettoken to ' \
-                    f'@{self.context.bot_user.username}. '
+                    f'@{escape_html(self.context.bot_user.username)}. '
         else:
             text += 'To reset, type /gettoken.'
 
-        return text, MessageType.Markdown
+        return text, MessageType.HTML
 
     @property
     def setsession_must_private_message(self):
@@ -143,7 +143,6 @@ More commands type /help.
 
     @staticmethod
     def rank_changed(rule_name, nickname, old_rank, new_rank):
-        nickname = nickname.replace('`', '`\``')
         old_rank_s_plus_number = old_rank.s_plus_number if old_rank.s_plus_number else ''
         new_rank_s_plus_number = new_rank.s_plus_number if new_rank.s_plus_number else ''
 
@@ -158,26 +157,27 @@ More commands type /help.
             change = 'RankDown'
             change_icon = '⬇️'
 
-        return f'{change_icon} #{change} *{nickname}* `{rule_name}` ' \
-               f'{old_rank.name}{old_rank_s_plus_number} -> ' \
-               f'{new_rank.name}{new_rank_s_plus_number}', MessageType.Markdown
+        return f'{change_icon} #{change} {bold(nickname)} {code(rule_name)} ' \
+               f'{old_rank.name}{old_rank_s_plus_number} -&gt; ' \
+               f'{new_rank.name}{new_rank_s_plus_number}', MessageType.HTML
 
-    def last50_overview(self, battle_overview):
+    def last50_overview(self, battle_overview, history=None):
         battles = battle_overview.results
         summary = battle_overview.summary
 
         lines = list()
 
         display_name = self.context.user.display_name
-        lines.append(
-            f'Last 50 Battle For {escape_markdown(display_name, version=2)}')
+        lines.append(f'Last 50 Battle For {escape_html(display_name)}')
 
         lines.append(
-            '*▸* `V/D: `*{0}/{1}*`({2:.0f}%)`'.format(summary.victory_count,
-                                                      summary.defeat_count,
-                                                      summary.victory_rate * 100))
+            '<b>▸</b> <code>V/D: </code><b>{0}/{1}</b><code>({2:.0f}%)</code>'
+            .format(summary.victory_count,
+                    summary.defeat_count,
+                    summary.victory_rate * 100))
 
-        lines.append('*▸* `AVG: `*{0:.1f}*`({1:.1f})k `*{2:.1f}*`d {3:.1f}sp`'
+        lines.append('<b>▸</b> <code>AVG: </code><b>{0:.1f}</b><code>({1:.1f})k </code>'
+                     '<b>{2:.1f}</b><code>d {3:.1f}sp</code>'
                      .format(summary.kill_count_average,
                              summary.assist_count_average,
                              summary.death_count_average,
@@ -194,10 +194,29 @@ More commands type /help.
                 lines.append(line)
                 line = ''
 
-        return '\n'.join(lines), MessageType.Markdown
+        if history and history['count']:
+            count = history['count']
+            victory_count = history['victory_count']
+            lines.append(
+                '<b>▸</b> <code>ALL: </code><b>{0}/{1}</b><code>({2:.0f}%) '
+                '{3} battles</code>'
+                .format(victory_count,
+                        count - victory_count,
+                        victory_count / count * 100,
+                        count))
+            lines.append('<b>▸</b> <code>AVG: </code><b>{0:.1f}</b><code>({1:.1f})k </code>'
+                         '<b>{2:.1f}</b><code>d {3:.1f}sp</code>'
+                         .format(history['kill_count_average'],
+                                 history['assist_count_average'],
+                                 history['death_count_average'],
+                                 history['special_count_average']))
+
+        return '\n'.join(lines), MessageType.HTML
 
     def last_battle(self, battle):
-        return _battle_result_msg(battle, self.context.user.sp2_user)
+        # One viewer, nobody else renders it
+        return _battle_result_msg(battle, self.context.user.sp2_user,
+                                  cache=False)
 
     @staticmethod
     def user_info(info):
@@ -210,181 +229,219 @@ More commands type /help.
         lp = record["league_stats"]["pair"]
         lt = record["league_stats"]["team"]
         lines = [
-            f'`{player["nickname"]}, {rank}`',
-            f'*真格段位：* 区 `{player["udemae_zones"]["name"]}` | 塔 `{player["udemae_tower"]["name"]}` | 鱼 `{player["udemae_rainmaker"]["name"]}` | 蛤 `{player["udemae_clam"]["name"]}`',
-            f'*最近场数：* {record["recent_win_count"]}/{record["recent_lose_count"]}',
-            f'*最近掉线：* {record["recent_disconnect_count"]}',
-            f'*所有记录：* {record["win_count"] + record["lose_count"]} | {record["win_count"]}/{record["lose_count"]}',
-            f'*双排记录：* {player["max_league_point_pair"]}',
-            f'*▸* 🥇 `{lp["gold_count"]:>3}`  🥈 `{lp["silver_count"]:>3}`  🥉 `{lp["bronze_count"]:>3}`  无 `{lp["no_medal_count"]:>3}`  共 `{sum(lp.values())}`',
-            f'*四排记录：* {player["max_league_point_team"]}',
-            f'*▸* 🥇 `{lt["gold_count"]:>3}`  🥈 `{lt["silver_count"]:>3}`  🥉 `{lt["bronze_count"]:>3}`  无 `{lt["no_medal_count"]:>3}`  共 `{sum(lt.values())}`',
-            f'*首次游戏：* {dt.utcfromtimestamp(record["start_time"]):%Y-%m-%d %H:%M:%S} (UTC)',
-            f'*最近游玩：* {dt.utcfromtimestamp(record["update_time"]):%Y-%m-%d %H:%M:%S (UTC)}'
+            code(f'{player["nickname"]}, {rank}'),
+            f'<b>真格段位：</b> 区 {code(player["udemae_zones"]["name"])} | 塔 {code(player["udemae_tower"]["name"])} | 鱼 {code(player["udemae_rainmaker"]["name"])} | 蛤 {code(player["udemae_clam"]["name"])}',
+            f'<b>最近场数：</b> {record["recent_win_count"]}/{record["recent_lose_count"]}',
+            f'<b>最近掉线：</b> {record["recent_disconnect_count"]}',
+            f'<b>所有记录：</b> {record["win_count"] + record["lose_count"]} | {record["win_count"]}/{record["lose_count"]}',
+            f'<b>双排记录：</b> {player["max_league_point_pair"]}',
+            f'<b>▸</b> 🥇 <code>{lp["gold_count"]:>3}</code>  🥈 <code>{lp["silver_count"]:>3}</code>  🥉 <code>{lp["bronze_count"]:>3}</code>  无 <code>{lp["no_medal_count"]:>3}</code>  共 <code>{sum(lp.values())}</code>',
+            f'<b>四排记录：</b> {player["max_league_point_team"]}',
+            f'<b>▸</b> 🥇 <code>{lt["gold_count"]:>3}</code>  🥈 <code>{lt["silver_count"]:>3}</code>  🥉 <code>{lt["bronze_count"]:>3}</code>  无 <code>{lt["no_medal_count"]:>3}</code>  共 <code>{sum(lt.values())}</code>',
+            f'<b>首次游戏：</b> {dt.utcfromtimestamp(record["start_time"]):%Y-%m-%d %H:%M:%S} (UTC)',
+            f'<b>最近游玩：</b> {dt.utcfromtimestamp(record["update_time"]):%Y-%m-%d %H:%M:%S (UTC)}'
         ]
-        return '\n'.join(lines), MessageType.Markdown
+        return '\n'.join(lines), MessageType.HTML
+
+    @staticmethod
+    def medal_changed(old_pair, new_pair, old_team, new_team):
+        msg = ''
+        if old_pair != new_pair:
+            msg += f"双排奖章更新！{_medal_str(old_pair, new_pair)}"
+        if old_team != new_team:
+            msg += f"四排奖章更新！{_medal_str(old_team, new_team)}"
+        return msg
 
     @staticmethod
-    def medal_msg(battle_poll, splatoon2):
-        try:
-            last_medal = battle_poll.last_medal
-            if last_medal and battle_poll.flag_medal == 0:
-                return
-            if last_medal and ((dt.now().hour % 2) or (dt.now().minute > 20)):
-                return
-
-            if last_medal:
-                last_medal = json.loads(last_medal) or {}
-            # print(f'last_medal: {last_medal}')
-
-            user_info = splatoon2.get_user_info()
-            league_info = user_info["records"]["league_stats"]
-            current_medal = {'lp': league_info["pair"], 'lt': league_info["team"]}
-            # print(f'curr_medal: {current_medal}')
-
-            battle_poll.last_medal = json.dumps(current_medal)
-
-            if not last_medal:
-                return
-            msg = ''
-            if last_medal['lp'] != current_medal['lp']:
-                msg += f"双排奖章更新！{_medal_str(last_medal['lp'], current_medal['lp'])}"
-            if last_medal['lt'] != current_medal['lt']:
-                msg += f"四排奖章更新！{_medal_str(last_medal['lt'], current_medal['lt'])}"
-
-            if msg:
-                battle_poll.flag_medal = 0
-
-            return msg
-        except Exception as ex:
-            print(f'Exception, medal_msg: {ex}')
-            return
+    def push_battle(battle, battle_poll, highlights=()):
+        return _battle_result_msg(battle, battle_poll.user.sp2_user,
+                                  battle_poll, highlights)
 
     @staticmethod
-    def push_battle(battle, battle_poll):
-        return _battle_result_msg(battle, battle_poll.user.sp2_user, battle_poll)
+    def push_battles(battles, battle_poll, highlights=()):
+        # Battles are oldest first, only the last one is shown in full
+        *earlier, last = battles
+        content, message_type = Message.push_battle(last, battle_poll,
+                                                    highlights)
+        if not earlier:
+            return content, message_type
+
+        lines = [code(f'+{len(earlier)} battles since last push:')]
+        lines += [_battle_digest_line(battle) for battle in earlier]
+        lines.append('')
+        lines.append(content)
+
+        return '\n'.join(lines), message_type
 
 
 def _medal_str(old_m, new_m):
     msg = ''
-    if old_m['gold_count'] != new_m['gold_count']:
-        msg += '获得` 🥇 `'
-    elif old_m['silver_count'] != new_m['silver_count']:
-        msg += '获得` 🥈 `'
-    elif old_m['bronze_count'] != new_m['bronze_count']:
-        msg += '获得` 🥉 `'
+    if old_m.gold_count != new_m.gold_count:
+        msg += '获得<code> 🥇 </code>'
+    elif old_m.silver_count != new_m.silver_count:
+        msg += '获得<code> 🥈 </code>'
+    elif old_m.bronze_count != new_m.bronze_count:
+        msg += '获得<code> 🥉 </code>'
     else:
         msg += '分数太低啦~ 没有牌牌，下次加油！'
     return msg
 
 
-def _battle_result_msg(battle, sp2_user, battle_poll=None):
-    lines = list()
-
-    if battle_poll:
-        if battle.victory:
-            lines.append('我们赢啦！')
-            battle_poll.last_battle_status = max(battle_poll.last_battle_status, 0) + 1
-        else:
-            lines.append('呜呜呜~输了不好意思见人了~')
-            battle_poll.last_battle_status = min(battle_poll.last_battle_status, 0) - 1
-
-        victory_rate = 0
-        if battle_poll.game_count > 0:
-            victory_rate = battle_poll.game_victory_count / battle_poll.game_count * 100
-
-        victory_count = battle_poll.game_victory_count
-        defeat_count = battle_poll.game_count - battle_poll.game_victory_count
+def _battle_digest_line(battle):
+    me = battle.player_result
+    icon = '🤪' if battle.victory else '👿'
+    return f'{icon} {code(battle.rule.name)} ' \
+           f'<code>{me.kill_count}({me.assist_count})k {me.death_count}d ' \
+           f'{me.special_count}sp</code>'
 
-        battle_stat = f'`当前胜率{victory_rate:.0f}% 胜{victory_count} 负{defeat_count}`'
 
-        streak = battle_poll.last_battle_status
-        if abs(streak) >= 3:
-            if streak > 0:
-                battle_stat += f'`, {streak}连胜`'
-            else:
-                battle_stat += f'`, {abs(streak)}连败`'
+_SELF_MARKER = ' 👨🏻‍✈️'
 
-        lines.append(battle_stat)
+# Rendered member lines of recent teams by (start_time, principal_id of the
+# first member), as (principal_ids, lines) in member order.
+# battle_number is per player, start_time is the same for everyone in the
+# battle and a player is in one lobby at a time.
+_MEMBER_LINES_CACHE_SIZE = 1024
+_member_lines = OrderedDict()
+_member_lines_lock = threading.Lock()
 
-        if battle.battle_type == SP2BattleType.League:
-            battle_poll.flag_medal = 1
 
+def _battle_result_msg(battle, sp2_user, battle_poll=None, highlights=(),
+                       cache=True):
+    # f-strings throughout, they are the cheapest way to build a message
+    if battle_poll:
+        head = _push_head(battle, battle_poll)
     else:
-        lines.append(f"Battle ID:{battle.battle_number}")
+        head = f"Battle ID:{battle.battle_number}"
 
-    rule_info = ''
-    if battle.battle_type == SP2BattleType.Gachi:
-        power = f'  Power: {battle.estimate_gachi_power}' if battle.estimate_gachi_power else ''
-        rule_info = f'`{battle.rule.name}:{battle.player_result.player.udemae.name}{power}`'
-    elif battle.battle_type == SP2BattleType.League:
-        max_league_point = ''
-        if battle.max_league_point > 0:
-            max_league_point = f'\nmax_league_point: {battle.max_league_point}'
-        rule_info = f'`{battle.rule.name}, {battle.game_mode}{max_league_point}`'
-    if rule_info:
-        lines.append(rule_info)
+    if battle.victory:
+        winners, losers = battle.my_team_members, battle.other_team_members
+    else:
+        winners, losers = battle.other_team_members, battle.my_team_members
+
+    self_principal_id = sp2_user.principal_id if sp2_user else None
+    start_time = battle.start_time if cache else None
+    rule = _battle_rule(battle)
+    if rule:
+        head = f'{head}\n{rule}'
+
+    return f'{head}\n' \
+           f'{_battle_team_title(battle.victory, battle)}\n' \
+           f'{_battle_result_member(self_principal_id, winners, start_time, highlights)}\n' \
+           f'{_battle_team_title(not battle.victory, battle)}\n' \
+           f'{_battle_result_member(self_principal_id, losers, start_time, highlights)}', \
+        MessageType.HTML
+
+
+def _push_head(battle, battle_poll):
+    game_count = battle_poll.game_count
+    victory_count = battle_poll.game_victory_count
+    rate = victory_count / game_count * 100 if game_count > 0 else 0
+
+    streak = battle_poll.last_battle_status
+    if streak >= 3:
+        streak = f'<code>, {streak}连胜</code>'
+    elif streak <= -3:
+        streak = f'<code>, {-streak}连败</code>'
+    else:
+        streak = ''
 
-    my_team_is_top = battle.victory
+    result = '我们赢啦！' if battle.victory else '呜呜呜~输了不好意思见人了~'
+    return f'{result}\n<code>当前胜率{rate:.0f}% 胜{victory_count} ' \
+           f'负{game_count - victory_count}</code>{streak}'
 
-    my_or_other_members = [battle.my_team_members, battle.other_team_members]
 
-    lines.append(_battle_team_title(my_team_is_top, battle))
-    lines.append(_battle_result_member(sp2_user, my_or_other_members[not my_team_is_top]))
+def _battle_rule(battle):
+    if battle.battle_type == SP2BattleType.Gachi:
+        power = battle.estimate_gachi_power
+        power = f'  Power: {escape_html(power)}' if power else ''
+        return f'<code>{escape_html(battle.rule.name)}:' \
+               f'{escape_html(battle.player_result.player.udemae.name)}' \
+               f'{power}</code>'
 
-    lines.append(_battle_team_title(not my_team_is_top, battle))
-    lines.append(_battle_result_member(sp2_user, my_or_other_members[my_team_is_top]))
+    if battle.battle_type == SP2BattleType.League:
+        max_league_point = battle.max_league_point
+        max_league_point = f'\nmax_league_point: {max_league_point}' \
+            if max_league_point > 0 else ''
+        return f'<code>{escape_html(battle.rule.name)}, ' \
+               f'{escape_html(battle.game_mode)}{max_league_point}</code>'
 
-    return '\n'.join(lines), MessageType.Markdown
+    return None
 
 
 def _battle_team_title(my_team: bool, battle: SP2BattleResult):
     if my_team:
-        team_title = 'VICTORY' if battle.victory else 'DEFEAT'
+        title = 'VICTORY' if battle.victory else 'DEFEAT'
     else:
-        team_title = 'DEFEAT' if battle.victory else 'VICTORY'
+        title = 'DEFEAT' if battle.victory else 'VICTORY'
 
-    point = ' '
     if battle.battle_type == SP2BattleType.Regular:
-        point = ' {:.1f}'.format([battle.my_team_percentage,
-                                  battle.other_team_percentage]
-                                 [not my_team])
-    elif battle.battle_type == SP2BattleType.League:
-        point = ' {}'.format([battle.my_estimate_league_point,
-                              battle.other_estimate_league_point]
-                             [not my_team])
-
-    return f'{team_title} {battle.battle_type}{point}：'
-
-
-def _battle_result_member(self_sp2_user, members):
-    def format_member(member):
-        escaped_nickname = member.player.nickname.replace('`', '`\``')
-        nickname = f'`{escaped_nickname}`'
-
-        # If self
-        if self_sp2_user and member.player.principal_id == self_sp2_user.principal_id:
-            nickname = f'{nickname} 👨🏻‍✈️'
-
-        # turf_war don't have udemae info
-        if member.player.udemae and member.player.udemae.name:
-            return '`{:<2}|{:>2} {:>2}+{}k`  `{:>2}d {:>4.1f} {:>2}sp ` {}' \
-                .format(member.player.udemae.name, member.kill_count,
-                        member.kill_count - member.assist_count,
-                        member.assist_count,
-                        member.death_count,
-                        (member.kill_count - member.assist_count) / member.death_count if member.death_count else 99.0,
-                        member.special_count,
-                        nickname)
-
-        avatar = '🐙' if member.player.species == SP2PlayerSpecies.Octolings else '🦑'
-
-        return '{}`{:>2}({})k` `{:>2}d {}sp` {}' \
-            .format(avatar,
-                    member.kill_count,
-                    member.assist_count,
-                    member.death_count,
-                    member.special_count,
-                    nickname)
-
-    return '\n'.join(map(format_member, members))
+        point = battle.my_team_percentage \
+            if my_team else battle.other_team_percentage
+        return f'{title} regular {point:.1f}：'
+    if battle.battle_type == SP2BattleType.League:
+        point = battle.my_estimate_league_point \
+            if my_team else battle.other_estimate_league_point
+        return f'{title} league {point}：'
+    return f'{title} {battle.battle_type} ：'
+
+
+def _battle_result_member(self_principal_id, members, start_time,
+                          highlights=()):
+    # Without a start_time the lines are not cached
+    principal_ids = [m.player.principal_id for m in members]
+
+    key = (start_time, principal_ids[0]) \
+        if principal_ids and start_time is not None else None
+    cached = _member_lines.get(key) if key else None
+    # Another viewer's list may order tied members differently
+    if cached is not None and cached[0] == principal_ids:
+        lines = cached[1]
+    else:
+        lines = [_format_member(m) for m in members]
+        if key:
+            _member_lines[key] = (principal_ids, lines)
+            if len(_member_lines) > _MEMBER_LINES_CACHE_SIZE:
+                with _member_lines_lock:
+                    while len(_member_lines) > _MEMBER_LINES_CACHE_SIZE:
+                        _member_lines.popitem(last=False)
+
+    # The self marker differs per viewer, so it stays out of the cache.
+    # Shared pushes mark every registered player.
+    if highlights:
+        marked = [i for i, principal_id in enumerate(principal_ids)
+                  if principal_id in highlights or
+                  principal_id == self_principal_id]
+    elif self_principal_id in principal_ids:
+        marked = (principal_ids.index(self_principal_id),)
+    else:
+        marked = ()
+
+    if marked:
+        lines = list(lines)
+        for i in marked:
+            lines[i] += _SELF_MARKER
+
+    return '\n'.join(lines)
+
+
+def _format_member(member):
+    # Member lines are the bulk of a render, hence one f-string each
+    player = member.player
+    nickname = escape_html(player.nickname)
+
+    # turf_war don't have udemae info
+    udemae = player.udemae
+    if udemae and udemae.name:
+        kill_count = member.kill_count - member.assist_count
+        death_count = member.death_count
+        ratio = kill_count / death_count if death_count else 99.0
+        return f'<code>{udemae.name:<2}|{member.kill_count:>2} ' \
+               f'{kill_count:>2}+{member.assist_count}k</code>  ' \
+               f'<code>{death_count:>2}d {ratio:>4.1f} ' \
+               f'{member.special_count:>2}sp </code> <code>{nickname}</code>'
+
+    avatar = '🐙' if player.species == SP2PlayerSpecies.Octolings else '🦑'
+    return f'{avatar}<code>{member.kill_count:>2}({member.assist_count})k' \
+           f'</code> <code>{member.death_count:>2}d ' \
+           f'{member.special_count}sp</code> <code>{nickname}</code>'
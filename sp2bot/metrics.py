@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Counts observations in fixed buckets, like a Prometheus histogram."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # The last count is for observations above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        counts, _, count = self.snapshot()
+        if not count:
+            return 0.0
+
+        rank = q * count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    @property
+    def stats(self):
+        return {
+            'count': self.count,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+
+class MetricsSink:
+    """Receives timings and counts. This one drops them, subclass it to
+    send them elsewhere and install it with set_sink."""
+
+    def observe(self, name, value, labels=()):
+        pass
+
+    def inc(self, name, value=1, labels=()):
+        pass
+
+    def render(self):
+        return ''
+
+
+class PrometheusSink(MetricsSink):
+    """Keeps histograms and counters in memory for the text exporter."""
+
+    def __init__(self, prefix='sp2bot'):
+        self.prefix = prefix
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+        histogram.observe(value)
+
+    def inc(self, name, value=1, labels=()):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self):
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        lines = []
+        typed = set()
+        for (name, labels), histogram in histograms:
+            name = f'{self.prefix}_{name}'
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + ('+Inf',),
+                                           counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket'
+                             f'{_labels(labels + (("le", bound),))} '
+                             f'{cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+
+        for (name, labels), value in counters:
+            name = f'{self.prefix}_{name}'
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{_labels(labels)} {value}')
+
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+_sink = PrometheusSink()
+
+# Callables returning {name: number}, exported as gauges
+_gauges = {}
+
+
+def set_sink(sink):
+    global _sink
+    _sink = sink
+
+
+def get_sink():
+    return _sink
+
+
+def observe(name, value, **labels):
+    _sink.observe(name, value, _label_key(labels))
+
+
+def inc(name, value=1, **labels):
+    _sink.inc(name, value, _label_key(labels))
+
+
+@contextmanager
+def span(stage, **labels):
+    # Time spent in one stage: db, nintendo, telegram or render
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe('stage_seconds', time.monotonic() - started,
+                stage=stage, **labels)
+
+
+def register_gauges(name, collect):
+    _gauges[name] = collect
+
+
+def render():
+    lines = [_sink.render()]
+    for group, collect in sorted(_gauges.items()):
+        try:
+            values = collect() or {}
+        except Exception as e:
+            print(f'Exception, gauges {group}: {e}')
+            continue
+
+        for name, value in sorted(values.items()):
+            # Only plain numbers are gauges
+            if isinstance(value, bool) or \
+                    not isinstance(value, (int, float)):
+                continue
+            lines.append(f'sp2bot_{group}_{name} {value}\n')
+
+    return ''.join(lines)
+
+
+def start_exporter(port, listen='127.0.0.1'):
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((listen, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever,
+                     name='metrics',
+                     daemon=True).start()
+    return server
+
+
+def _label_key(labels):
+    # Values as strings, keys must sort whatever type a label was given
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape_label(value)}"'
+                     for key, value in labels)
+    return f'{{{pairs}}}'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
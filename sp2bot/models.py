@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import time
 
 from telegram import Chat
 
-from sp2bot.splatoon2models import SP2Player
+from sp2bot.splatoon2models import SP2Player, SP2BattleType, \
+    SP2LeagueMedals, league_rotation_end
+from sp2bot.utils import jsoncodec
 from sp2bot.utils.model import Model
 
 
@@ -72,10 +75,14 @@ class BattlePoll(Model):
                  last_battle_udemae=None,
                  last_battle_rule=None,
                  last_battle_status=0,
-                 last_medal=None,
+                 medals_pair=None,
+                 medals_team=None,
                  flag_medal=0,
+                 medal_due_at=None,
                  game_count=0,
-                 game_victory_count=0):
+                 game_victory_count=0,
+                 poll_interval=None,
+                 unchanged_poll_count=0):
         self.chat = chat
         self.user = user
         self.last_message_id = last_message_id
@@ -86,8 +93,67 @@ class BattlePoll(Model):
         self.game_count = game_count
         self.game_victory_count = game_victory_count
 
-        self.last_medal = last_medal
+        # League medal counts, flag_medal is set from a League battle
+        # until its medal is seen, due after its rotation
+        self.medals_pair = medals_pair
+        self.medals_team = medals_team
         self.flag_medal = flag_medal
+        self.medal_due_at = medal_due_at
+
+        # Adaptive polling, None is the fast rate
+        self.poll_interval = poll_interval
+        self.unchanged_poll_count = unchanged_poll_count
+
+    def __setattr__(self, key, value):
+        # Writing the same value again is not a change
+        changed = key.startswith('_') or \
+            key not in self.__dict__ or self.__dict__[key] != value
+        super(BattlePoll, self).__setattr__(key, value)
+        if changed and not key.startswith('_'):
+            super(BattlePoll, self).__setattr__('_dirty', True)
+
+    # Changed since the last write to database
+    @property
+    def dirty(self):
+        return self._dirty
+
+    def mark_clean(self):
+        self._dirty = False
+
+    def mark_dirty(self):
+        self._dirty = True
+
+    def record_battle(self, battle):
+        self.game_count += 1
+        self.game_victory_count += int(battle.victory)
+        if battle.victory:
+            self.last_battle_status = max(self.last_battle_status, 0) + 1
+        else:
+            self.last_battle_status = min(self.last_battle_status, 0) - 1
+
+        self.last_battle_number = battle.battle_number
+        self.last_battle_udemae = battle.player_result.player.udemae
+        self.last_battle_rule = battle.rule.key
+
+        if battle.battle_type == SP2BattleType.League:
+            self.flag_medal = 1
+            self.medal_due_at = league_rotation_end(
+                battle.start_time or time.time())
+
+    def back_off(self, interval, max_interval, grace):
+        # Idle at the slowest rate, nothing left to count
+        if self.poll_interval == max_interval:
+            return
+
+        self.unchanged_poll_count += 1
+
+        exponent = self.unchanged_poll_count - grace
+        if exponent > 0:
+            self.poll_interval = min(max_interval, interval * 2 ** exponent)
+
+    def reset_poll_interval(self):
+        self.unchanged_poll_count = 0
+        self.poll_interval = None
 
     @classmethod
     def de_json(cls, data):
@@ -100,4 +166,16 @@ class BattlePoll(Model):
         data['chat'] = Chat.de_json(data.get('chat'), None)
         data['last_battle_udemae'] = SP2Player.Udemae.de_json(data.get('last_battle_udemae', None))
 
+        # Medal counts used to be a JSON string
+        last_medal = data.pop('last_medal', None)
+        if last_medal and 'medals_pair' not in data:
+            last_medal = jsoncodec.loads(last_medal) or {}
+            data['medals_pair'] = last_medal.get('lp')
+            data['medals_team'] = last_medal.get('lt')
+        data['medals_pair'] = SP2LeagueMedals.de_json(data.get('medals_pair'))
+        data['medals_team'] = SP2LeagueMedals.de_json(data.get('medals_team'))
+        # A pending medal stored without a due time is due now
+        if data.get('flag_medal') and data.get('medal_due_at') is None:
+            data['medal_due_at'] = time.time()
+
         return cls(**data)
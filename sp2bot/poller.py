@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sp2bot.utils.model import Model
+
+
+class PollJob:
+
+    def __init__(self, name, callback, interval, context=None):
+        self.name = name
+        self.callback = callback
+        self.interval = interval
+        self.context = context
+        # Monotonic time the next poll is scheduled at
+        self.due = 0
+        self.due_tick = 0
+        self.running = False
+        self._removed = False
+
+    @property
+    def removed(self):
+        return self._removed
+
+    def schedule_removal(self):
+        self._removed = True
+
+
+class PollTickMetrics(Model):
+
+    def __init__(self,
+                 tick,
+                 jobs,
+                 due,
+                 dispatched,
+                 deferred,
+                 skipped,
+                 completed,
+                 failed,
+                 in_flight,
+                 lag):
+        self.tick = tick
+        self.jobs = jobs
+        self.due = due
+        self.dispatched = dispatched
+        self.deferred = deferred
+        self.skipped = skipped
+        self.completed = completed
+        self.failed = failed
+        self.in_flight = in_flight
+        self.lag = lag
+
+
+class PollScheduler:
+    """Runs every PollJob on a shared hashed time wheel.
+
+    `tick` is driven from outside (the JobQueue) every `resolution` seconds.
+    New jobs land in a random slot so polls spread over the interval, due
+    jobs are throttled by a token bucket of `max_rate` polls per second and
+    run on a bounded pool of `workers` threads.
+    """
+
+    def __init__(self, interval=10, resolution=1, max_rate=20, workers=8):
+        self.interval = interval
+        self.resolution = resolution
+        self.max_rate = max_rate
+        self.max_in_flight = workers * 4
+        self.last_metrics = None
+
+        self._wheel = [set() for _ in
+                       range(max(1, math.ceil(interval / resolution)))]
+        self._backlog = deque()
+        self._jobs = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='poll')
+        self._started = time.monotonic()
+        self._tick = -1
+        self._tokens = max_rate
+        self._last_refill = self._started
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+
+    @property
+    def job_count(self):
+        return len(self._jobs)
+
+    def add(self, job, first=None):
+        now = time.monotonic()
+        if first is None:
+            # Jitter the first poll over one interval
+            first = random.uniform(0, min(job.interval, self.interval))
+
+        with self._lock:
+            self._jobs.add(job)
+            self._schedule(job, now + first)
+
+    def remove(self, job):
+        job.schedule_removal()
+        with self._lock:
+            self._jobs.discard(job)
+            self._wheel[job.due_tick % len(self._wheel)].discard(job)
+
+    def wake(self, job):
+        # Poll as soon as possible with the job's current interval
+        with self._lock:
+            if job.running or job.removed:
+                return
+            self._wheel[job.due_tick % len(self._wheel)].discard(job)
+            self._schedule(job, time.monotonic())
+
+    def tick(self, context=None):
+        now = time.monotonic()
+        current_tick = self._tick_at(now)
+
+        due = dispatched = deferred = skipped = 0
+        lag = 0.0
+        with self._lock:
+            # Catch up on ticks the JobQueue fired late
+            ready = list(self._backlog)
+            self._backlog.clear()
+            for t in range(self._tick + 1, current_tick + 1):
+                slot = self._wheel[t % len(self._wheel)]
+                for job in [j for j in slot if j.due_tick <= current_tick]:
+                    slot.discard(job)
+                    if job.removed:
+                        self._jobs.discard(job)
+                        continue
+                    ready.append(job)
+                    due += 1
+            self._tick = max(self._tick, current_tick)
+
+            self._refill(now)
+            for job in ready:
+                if job.removed:
+                    self._jobs.discard(job)
+                    continue
+                if job.running:
+                    # Last poll is still in flight, wait one more interval
+                    self._schedule(job, now + job.interval)
+                    skipped += 1
+                    continue
+                if self._tokens < 1 or self._in_flight >= self.max_in_flight:
+                    self._backlog.append(job)
+                    deferred += 1
+                    continue
+
+                self._tokens -= 1
+                self._in_flight += 1
+                job.running = True
+                lag = max(lag, now - job.due)
+                self._executor.submit(self._run, job)
+                dispatched += 1
+
+            completed, self._completed = self._completed, 0
+            failed, self._failed = self._failed, 0
+
+            self.last_metrics = PollTickMetrics(tick=current_tick,
+                                                jobs=len(self._jobs),
+                                                due=due,
+                                                dispatched=dispatched,
+                                                deferred=deferred,
+                                                skipped=skipped,
+                                                completed=completed,
+                                                failed=failed,
+                                                in_flight=self._in_flight,
+                                                lag=round(lag, 3))
+
+        return self.last_metrics
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job):
+        ok = True
+        try:
+            job.callback(job)
+        except Exception as e:
+            ok = False
+            print(f'Exception, poll {job.name}: {e}')
+        finally:
+            with self._lock:
+                job.running = False
+                self._in_flight -= 1
+                if ok:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+
+                if job.removed:
+                    self._jobs.discard(job)
+                else:
+                    # Keep the job's phase unless it fell behind
+                    self._schedule(job, max(job.due + job.interval,
+                                            time.monotonic()))
+
+    def _schedule(self, job, due):
+        job.due = due
+        job.due_tick = max(self._tick_at(due), self._tick + 1)
+        self._wheel[job.due_tick % len(self._wheel)].add(job)
+
+    def _tick_at(self, t):
+        return int((t - self._started) / self.resolution)
+
+    def _refill(self, now):
+        if not self.max_rate:
+            self._tokens = math.inf
+            return
+
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(self.max_rate,
+                           self._tokens + elapsed * self.max_rate)
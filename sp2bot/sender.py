@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from telegram.error import RetryAfter, BadRequest, TimedOut, NetworkError
+
+from sp2bot import metrics
+from sp2bot.utils.markup import validate_html
+
+# Telegram limits
+GLOBAL_RATE = 30
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0
+
+# Coalescable messages wait this long for siblings to merge into
+COALESCE_WINDOW = 0.3
+
+MAX_ATTEMPTS = 3
+
+
+class _Outbound:
+
+    def __init__(self, method, chat_id, kwargs, coalesce=False):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.coalesce = coalesce
+        self.futures = [Future()]
+        self.queued_at = time.monotonic()
+        self.ready_at = self.queued_at + (COALESCE_WINDOW if coalesce else 0)
+        self.attempts = 0
+
+    def merge(self, other):
+        if not (self.coalesce and other.coalesce and
+                self.method == other.method == 'send_message' and
+                self.kwargs.get('parse_mode') == other.kwargs.get('parse_mode')):
+            return False
+        if self.kwargs.get('reply_markup') and other.kwargs.get('reply_markup'):
+            return False
+
+        self.kwargs['text'] += '\n\n' + other.kwargs['text']
+        if other.kwargs.get('reply_markup'):
+            self.kwargs['reply_markup'] = other.kwargs['reply_markup']
+        self.futures += other.futures
+        return True
+
+
+class MessageSender:
+    """Sends every outbound Telegram message from one worker thread.
+
+    Keeps to Telegram's global and per chat limits, waits out 429s and
+    merges coalescable messages queued for the same chat.
+    """
+
+    def __init__(self):
+        self.bot = None
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+        self.parse_fallbacks = 0
+        self.invalid_markups = 0
+        self.latencies = deque(maxlen=1000)
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._chat_ready_at = {}
+        self._paused_until = 0
+        self._sent_times = deque()
+        self._worker = None
+        self._running = False
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    @property
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            'depth': self.depth,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'coalesced': self.coalesced,
+            'parse_fallbacks': self.parse_fallbacks,
+            'invalid_markups': self.invalid_markups,
+            'latency_p50': latencies[len(latencies) // 2] if latencies else 0,
+            'latency_p99': latencies[int(len(latencies) * 0.99)]
+            if latencies else 0,
+        }
+
+    def start(self, bot):
+        self.bot = bot
+        self._running = True
+        self._worker = threading.Thread(target=self._run,
+                                        name='sender',
+                                        daemon=True)
+        self._worker.start()
+
+    def stop(self, timeout=5):
+        # Drain what is queued, then stop
+        deadline = time.monotonic() + timeout
+        while self._queue and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def send_message(self, chat_id, text, parse_mode=None, reply_markup=None,
+                     coalesce=False):
+        kwargs = {'chat_id': chat_id, 'text': text}
+        if parse_mode == 'HTML' and not validate_html(text):
+            # Rendering bug, Telegram would reject it
+            self.invalid_markups += 1
+            print(f'Invalid HTML message: {text!r}')
+            parse_mode = None
+        if parse_mode:
+            kwargs['parse_mode'] = parse_mode
+        if reply_markup:
+            kwargs['reply_markup'] = reply_markup
+        return self._put(_Outbound('send_message', chat_id, kwargs, coalesce))
+
+    def delete_message(self, chat_id, message_id):
+        kwargs = {'chat_id': chat_id, 'message_id': message_id}
+        return self._put(_Outbound('delete_message', chat_id, kwargs))
+
+    def _put(self, outbound):
+        future = outbound.futures[0]
+        with self._condition:
+            for queued in reversed(self._queue):
+                if queued.chat_id != outbound.chat_id:
+                    continue
+                if queued.merge(outbound):
+                    self.coalesced += 1
+                    return future
+                break
+
+            self._queue.append(outbound)
+            self._condition.notify()
+        return future
+
+    def _next(self):
+        # First message whose chat may send now, or the time to wait
+        with self._condition:
+            while self._running:
+                now = time.monotonic()
+                wait = max(0, self._paused_until - now)
+
+                while self._sent_times and self._sent_times[0] <= now - 1:
+                    self._sent_times.popleft()
+                if len(self._sent_times) >= GLOBAL_RATE:
+                    wait = max(wait, self._sent_times[0] + 1 - now)
+
+                if not wait:
+                    wait = None
+                    # Messages of one chat keep their order
+                    blocked = set()
+                    for outbound in self._queue:
+                        if outbound.chat_id in blocked:
+                            continue
+                        ready_at = max(outbound.ready_at,
+                                       self._chat_ready_at.get(outbound.chat_id, 0))
+                        if ready_at <= now:
+                            self._queue.remove(outbound)
+                            return outbound
+                        blocked.add(outbound.chat_id)
+                        wait = min(wait, ready_at - now) \
+                            if wait is not None else ready_at - now
+
+                self._condition.wait(wait)
+            return None
+
+    def _run(self):
+        while True:
+            outbound = self._next()
+            if not outbound:
+                return
+            self._send(outbound)
+
+    def _send(self, outbound):
+        outbound.attempts += 1
+        method = getattr(self.bot, outbound.method)
+        now = time.monotonic()
+
+        try:
+            with metrics.span('telegram', op=outbound.method):
+                try:
+                    result = method(**outbound.kwargs)
+                except BadRequest:
+                    if outbound.method != 'send_message' or \
+                            'parse_mode' not in outbound.kwargs:
+                        raise
+                    # Resend as plain text
+                    self.parse_fallbacks += 1
+                    del outbound.kwargs['parse_mode']
+                    result = method(**outbound.kwargs)
+        except RetryAfter as e:
+            self._retry(outbound, e.retry_after, pause=True)
+            return
+        except BadRequest as e:
+            self._fail(outbound, e)
+            return
+        except (TimedOut, NetworkError) as e:
+            if outbound.attempts < MAX_ATTEMPTS:
+                self._retry(outbound, outbound.attempts)
+                return
+            self._fail(outbound, e)
+            return
+        except Exception as e:
+            self._fail(outbound, e)
+            return
+        finally:
+            self._sent_times.append(now)
+
+        if outbound.method == 'send_message':
+            interval = GROUP_CHAT_INTERVAL \
+                if isinstance(outbound.chat_id, int) and outbound.chat_id < 0 \
+                else PRIVATE_CHAT_INTERVAL
+            if len(self._chat_ready_at) > 10000:
+                self._chat_ready_at = {k: v for k, v in
+                                       self._chat_ready_at.items() if v > now}
+            self._chat_ready_at[outbound.chat_id] = now + interval
+
+        self.sent += 1
+        self.latencies.append(time.monotonic() - outbound.queued_at)
+        for future in outbound.futures:
+            future.set_result(result)
+
+    def _retry(self, outbound, delay, pause=False):
+        self.retried += 1
+        with self._condition:
+            outbound.ready_at = time.monotonic() + delay
+            if pause:
+                self._paused_until = outbound.ready_at
+            self._queue.appendleft(outbound)
+
+    def _fail(self, outbound, e):
+        self.failed += 1
+        print(f'Exception, {outbound.method} to {outbound.chat_id}: {e}')
+        for future in outbound.futures:
+            future.set_exception(e)
+
+
+sender = MessageSender()
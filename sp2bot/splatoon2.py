@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
+import re
 
 # import pycurl
 # from io import BytesIO
@@ -10,11 +11,19 @@ import certifi
 import requests, sys
 import uuid, time, random, string
 import os, base64, hashlib
+import threading
+from collections import OrderedDict
 import telegram.vendor.ptb_urllib3.urllib3 as urllib3
 from telegram.bot import log
 from telegram.error import TimedOut, NetworkError, _lstrip_str
 
+import configs
+from sp2bot import metrics
+from sp2bot.battlecache import battle_cache
 from sp2bot.splatoon2models import SP2User, SP2BattleOverview, SP2BattleResult
+from sp2bot.utils import jsoncodec
+from sp2bot.utils.jsonstream import iter_array
+from sp2bot.verifiers import auth_verifiers
 
 
 class Splatoon2SessionInvalid(Exception):
@@ -38,19 +47,97 @@ class Splatoon2Error(Exception):
         return '%s' % self.message
 
 
+# One keep-alive pool for the whole process
+_con_pool = None
+_con_pool_lock = threading.Lock()
+
+
+def connection_pool():
+    global _con_pool
+    if _con_pool is None:
+        with _con_pool_lock:
+            if _con_pool is None:
+                # Block on a full host pool instead of opening and
+                # dropping extra connections
+                _con_pool = urllib3.PoolManager(
+                    num_pools=10,
+                    maxsize=configs.SPLATOON2_POOL_MAXSIZE,
+                    block=True,
+                    timeout=urllib3.Timeout(connect=10.0, read=30.0),
+                    cert_reqs='CERT_REQUIRED',
+                    ca_certs=certifi.where()
+                )
+    return _con_pool
+
+
+# Battle numbers in paths, kept out of metric labels
+_ID_IN_PATH = re.compile(r'/\d+')
+
+# Time of the last successful response per session, sessions used by the
+# push loop need no keep-alive
+_SESSION_CONTACTS_SIZE = 100000
+_session_contacts = OrderedDict()
+_session_contacts_lock = threading.Lock()
+
+
+def last_contact(iksm_session):
+    # time.monotonic() of the last successful response, or None
+    return _session_contacts.get(iksm_session)
+
+
+def _touch_session(iksm_session):
+    with _session_contacts_lock:
+        _session_contacts[iksm_session] = time.monotonic()
+        _session_contacts.move_to_end(iksm_session)
+        if len(_session_contacts) > _SESSION_CONTACTS_SIZE:
+            _session_contacts.popitem(last=False)
+
+
+# Recent /api/records responses per session, expire after
+# RECORDS_CACHE_TTL seconds
+_RECORDS_CACHE_SIZE = 256
+_records_cache = OrderedDict()
+_records_cache_lock = threading.Lock()
+
+
+def _cache_records(iksm_session, data, now):
+    if configs.RECORDS_CACHE_TTL <= 0:
+        return
+
+    with _records_cache_lock:
+        _records_cache[iksm_session] = (now + configs.RECORDS_CACHE_TTL, data)
+        _records_cache.move_to_end(iksm_session)
+        # Oldest first, drop expired and overflowing entries
+        while _records_cache:
+            expires_at, _ = next(iter(_records_cache.values()))
+            if expires_at > now and \
+                    len(_records_cache) <= _RECORDS_CACHE_SIZE:
+                break
+            _records_cache.popitem(last=False)
+
+
 class Splatoon2:
 
-    def __init__(self, iksm_session):
+    @classmethod
+    def for_user(cls, user):
+        principal_id = user.sp2_user.principal_id if user.sp2_user else None
+        return cls(user.iksm_session, principal_id=principal_id)
+
+    def __init__(self, iksm_session, principal_id=None):
         self.iksm_session = iksm_session
+        # Owner of the session, enables the battle cache
+        self.principal_id = principal_id
         self._base_url = 'https://app.splatoon2.nintendo.net'
-        self._con_pool = urllib3.PoolManager(num_pools=50,
-                                             cert_reqs='CERT_REQUIRED',
-                                             ca_certs=certifi.where())
+        self._con_pool = connection_pool()
+        # ETag and Last-Modified per path for conditional requests, new
+        # ones wait in _new_validators for save_validators
+        self._validators = {}
+        self._new_validators = {}
 
     @log
     def get_user(self):
         try:
-            data = self.get('/api/records')
+            data = self.get_records()
             user = SP2User.de_json(data)
             return user
         except Splatoon2SessionInvalid:
@@ -59,20 +146,67 @@ class Splatoon2:
     @log
     def get_user_info(self):
         try:
-            return self.get('/api/records')
+            return self.get_records()
         except Splatoon2SessionInvalid:
             return None
 
+    def get_records(self):
+        # /api/records is heavy, a command or push tick needing it more
+        # than once shares one download. Treat the result as read only.
+        now = time.monotonic()
+        cached = _records_cache.get(self.iksm_session)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        data = self.get('/api/records')
+        _cache_records(self.iksm_session, data, now)
+        return data
+
     @log
-    def get_battle_overview(self):
-        data = self.get('/api/results')
-        battle_overview = SP2BattleOverview.de_json(data)
-        return battle_overview
+    def get_battle_overview(self, since=None, limit=None):
+        if since is None and limit is None:
+            data = self.get('/api/results')
+            battle_overview = SP2BattleOverview.de_json(data, lazy=True)
+            return battle_overview
+
+        # Incremental mode, only decode battles newer than `since`
+        path = '/api/results'
+        resp = self._send('GET', path, self._conditional_headers(path))
+        if resp.status == 304:
+            return SP2BattleOverview(None, None, [])
+        self._hold_validators(path, resp)
+
+        battles = []
+        try:
+            for data in iter_array(resp.data.decode('utf-8'), 'results'):
+                if since is not None and \
+                        str(data.get('battle_number')) == str(since):
+                    break
+                battles.append(SP2BattleResult.de_json(data))
+                if limit and len(battles) >= limit:
+                    break
+        except UnicodeDecodeError:
+            raise Splatoon2Error(
+                'Server response could not be decoded using UTF-8')
+        except ValueError:
+            raise Splatoon2Error('Invalid server response')
+
+        return SP2BattleOverview(None, None, battles)
 
     @log
-    def get_battle(self, battle_number):
-        data = self.get(f'/api/results/{battle_number}')
-        battle = SP2BattleResult.de_json(data)
+    # cache=False for bulk fetches that should not evict hot battles
+    def get_battle(self, battle_number, cache=True):
+        cache = cache and self.principal_id
+        if cache:
+            battle = battle_cache.get(self.principal_id, battle_number)
+            if battle:
+                return battle
+
+        raw = self._request('GET', f'/api/results/{battle_number}')
+        battle = SP2BattleResult.de_json(self.decode(raw))
+
+        if cache and battle:
+            battle_cache.put(self.principal_id, battle_number, battle, raw)
         return battle
 
     @log
@@ -87,11 +221,12 @@ class Splatoon2:
         return self.request(path, 'GET')
 
     def request(self, path, method):
-        json_data = self._request(method, path)
+        return self.decode(self._request(method, path))
+
+    @staticmethod
+    def decode(json_data):
         try:
-            decoded_s = json_data.decode('utf-8')
-            data = json.loads(decoded_s)
-            return data
+            return jsoncodec.loads(json_data)
         except UnicodeDecodeError:
             logging.getLogger(__name__).debug(
                 'Logging raw invalid UTF-8 response:\n%r', json_data)
@@ -114,7 +249,31 @@ class Splatoon2:
     #
     #     return buffer.getvalue()
 
+    def _conditional_headers(self, path):
+        headers = {}
+        etag, last_modified = self._validators.get(path, (None, None))
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    # Call once the battles of the last overview are handled. Until then
+    # the overview is downloaded again instead of answered with a 304
+    def save_validators(self):
+        self._validators.update(self._new_validators)
+        self._new_validators.clear()
+
+    def _hold_validators(self, path, resp):
+        etag = resp.headers.get('ETag')
+        last_modified = resp.headers.get('Last-Modified')
+        if etag or last_modified:
+            self._new_validators[path] = (etag, last_modified)
+
     def _request(self, method, path):
+        return self._send(method, path).data
+
+    def _send(self, method, path, headers=None):
         kwargs = {
             'method': method,
             'url': f"{self._base_url}{path}",
@@ -122,19 +281,26 @@ class Splatoon2:
                 'Cookie': f'iksm_session={self.iksm_session}; path=/; '
                           f'domain=.app.splatoon2.nintendo.net;',
                 'Accept': 'application/json',
-                'X-Requested-With': 'XMLHttpRequest'
+                'X-Requested-With': 'XMLHttpRequest',
+                **(headers or {})
             }
         }
 
+        op = _ID_IN_PATH.sub('/:id', path)
         try:
-            resp = self._con_pool.request(**kwargs)
+            with metrics.span('nintendo', op=op):
+                resp = self._con_pool.request(**kwargs)
         except urllib3.exceptions.TimeoutError:
+            metrics.inc('nintendo_requests_total', op=op, status='timeout')
             raise TimedOut()
         except urllib3.exceptions.HTTPError as error:
+            metrics.inc('nintendo_requests_total', op=op, status='error')
             raise NetworkError('urllib3 HTTPError {0}'.format(error))
+        metrics.inc('nintendo_requests_total', op=op, status=resp.status)
 
-        if 200 <= resp.status <= 299:
-            return resp.data
+        if 200 <= resp.status <= 299 or (resp.status == 304 and headers):
+            _touch_session(self.iksm_session)
+            return resp
         elif resp.status == 403:
             raise Splatoon2SessionInvalid()
         else:
@@ -142,7 +308,6 @@ class Splatoon2:
             raise NetworkError('{0} ({1})'.format(message, resp.status))
 
 
-AUTH_CODE_VERIFIERS = {}
 NSO_VERSION = '2.1.0'
 
 class Splatoon2Auth:
@@ -161,7 +326,7 @@ class Splatoon2Auth:
         auth_cv_hash.update(auth_code_verifier.replace(b"=", b""))
         auth_code_challenge = base64.urlsafe_b64encode(auth_cv_hash.digest())
 
-        AUTH_CODE_VERIFIERS[user_id] = auth_code_verifier
+        auth_verifiers.put(user_id, auth_code_verifier)
 
         app_head = {
             'Host': 'accounts.nintendo.com',
@@ -211,10 +376,9 @@ class Splatoon2Auth:
 
         session = requests.Session()
 
-        try:
-            auth_code_verifier = AUTH_CODE_VERIFIERS[user_id]
-        except:
-            # TODO:
+        auth_code_verifier = auth_verifiers.get(user_id)
+        if not auth_code_verifier:
+            # Expired or never asked for
             return None
 
         app_head = {
@@ -244,7 +408,9 @@ class Splatoon2Auth:
             return None
 
         # TODO:
-        return json.loads(r.text)["session_token"]
+        session_token = json.loads(r.text)["session_token"]
+        auth_verifiers.discard(user_id)
+        return session_token
 
     def get_cookie(self, session_token):
         '''Returns a new cookie provided the session_token.'''
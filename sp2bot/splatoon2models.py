@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from sp2bot.utils.model import Model
+from sp2bot.utils.model import Model, LazyModel, LazyList
 
 
 class SP2User(Model):
 
+    __slots__ = ('unique_id', 'player', 'session')
+
     def __init__(self, unique_id, player, session=None):
         self.unique_id = unique_id
         self.player = player
@@ -27,6 +29,7 @@ class SP2User(Model):
 
 
 class SP2BattleOverview(Model):
+    __slots__ = ('unique_id', 'summary', 'results')
 
     def __init__(self, unique_id, summary, results):
         self.unique_id = unique_id
@@ -34,20 +37,28 @@ class SP2BattleOverview(Model):
         self.results = results
 
     @classmethod
-    def de_json(cls, data):
+    def de_json(cls, data, lazy=False):
         if not data:
             return None
 
         data = super(SP2BattleOverview, cls).de_json(data)
 
         data['summary'] = SP2BattleResultsSummary.de_json(data.get('summary'))
-        data['results'] = SP2BattleResult.de_list(data.get('results'))
+        if lazy:
+            data['results'] = LazyList(data.get('results'),
+                                       SP2BattleResult.de_lazy)
+        else:
+            data['results'] = SP2BattleResult.de_list(data.get('results'))
 
         return cls(**data)
 
 
 class SP2BattleResultsSummary(Model):
 
+    __slots__ = ('victory_count', 'defeat_count', 'victory_rate',
+                 'kill_count_average', 'death_count_average',
+                 'assist_count_average', 'special_count_average', 'count')
+
     def __init__(self,
                  victory_count,
                  defeat_count,
@@ -83,8 +94,26 @@ class SP2BattleType:
     Gachi = 'gachi'
 
 
+# Fields of a lazily decoded SP2BattleResult read from the raw dict
+_LAZY_BATTLE_FIELDS = {
+    'battle_number': lambda d: d.get('battle_number'),
+    'battle_type': lambda d: d.get('type'),
+    'start_time': lambda d: d.get('start_time'),
+    'victory': lambda d: d['my_team_result']['key'] == 'victory',
+}
+
+
 class SP2BattleResult(Model):
+    __slots__ = ('battle_number', 'battle_type', 'rule', 'player_result',
+                 'victory', 'game_mode', 'max_league_point',
+                 'my_team_members', 'my_team_percentage',
+                 'my_estimate_league_point', 'other_team_members',
+                 'other_team_percentage', 'other_estimate_league_point',
+                 'estimate_gachi_power', 'start_time')
+
     class Rule(Model):
+        __slots__ = ('key', 'name')
+
         def __init__(self, key, name):
             self.key = key
             self.name = name
@@ -115,6 +144,7 @@ class SP2BattleResult(Model):
                  other_team_percentage=None,
                  other_estimate_league_point=None,
                  estimate_gachi_power=None,
+                 start_time=None,
                  ):
         self.battle_number = battle_number
         self.battle_type = battle_type
@@ -130,6 +160,7 @@ class SP2BattleResult(Model):
         self.other_team_percentage = other_team_percentage
         self.other_estimate_league_point = other_estimate_league_point
         self.estimate_gachi_power = estimate_gachi_power
+        self.start_time = start_time
 
     @classmethod
     def de_json(cls, data):
@@ -151,7 +182,7 @@ class SP2BattleResult(Model):
                     'my_team_members', 'my_team_percentage',
                     'my_estimate_league_point', 'other_team_members',
                     'other_team_percentage', 'other_estimate_league_point',
-                    'rule', 'estimate_gachi_power'):
+                    'rule', 'estimate_gachi_power', 'start_time'):
                 battle[key] = data[key]
 
         if data.get("x_power"):
@@ -184,6 +215,13 @@ class SP2BattleResult(Model):
 
         return cls(**battle)
 
+    @classmethod
+    def de_lazy(cls, data):
+        if not data:
+            return None
+
+        return LazyModel(cls.de_json, data, _LAZY_BATTLE_FIELDS)
+
     @classmethod
     def de_list(cls, data):
         if not data:
@@ -198,6 +236,9 @@ class SP2BattleResult(Model):
 
 class SP2BattleResultMember(Model):
 
+    __slots__ = ('kill_count', 'assist_count', 'death_count', 'special_count',
+                 'sort_score', 'game_paint_point', 'player')
+
     def __init__(self,
                  kill_count,
                  assist_count,
@@ -245,7 +286,12 @@ class SP2PlayerSpecies:
 
 
 class SP2Player(Model):
+    __slots__ = ('principal_id', 'nickname', 'udemae', 'style', 'species',
+                 'weapon')
+
     class Udemae(Model):
+        __slots__ = ('name', 's_plus_number')
+
         def __init__(self, name, s_plus_number=None):
             self.name = name
             self.s_plus_number = s_plus_number
@@ -299,6 +345,8 @@ class SP2Player(Model):
 
 
 class SP2PlayerWeapon(Model):
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = name
 
@@ -315,3 +363,44 @@ class SP2PlayerWeapon(Model):
                 battle[key] = data[key]
 
         return cls(**battle)
+
+
+class SP2LeagueMedals(Model):
+    __slots__ = ('gold_count', 'silver_count', 'bronze_count',
+                 'no_medal_count')
+
+    def __init__(self, gold_count=0, silver_count=0, bronze_count=0,
+                 no_medal_count=0):
+        self.gold_count = gold_count
+        self.silver_count = silver_count
+        self.bronze_count = bronze_count
+        self.no_medal_count = no_medal_count
+
+    def __eq__(self, other):
+        return isinstance(other, SP2LeagueMedals) and \
+               all(getattr(self, k) == getattr(other, k)
+                   for k in self.__slots__)
+
+    @classmethod
+    def de_json(cls, data):
+        if not data:
+            return None
+
+        data = super(SP2LeagueMedals, cls).de_json(data)
+
+        medals = dict()
+        for key in data:
+            if key in cls.__slots__:
+                medals[key] = data[key]
+
+        return cls(**medals)
+
+
+# League rotations last two hours from even UTC hours, medals are awarded
+# once the rotation is over
+LEAGUE_ROTATION_SECONDS = 7200
+
+
+def league_rotation_end(start_time):
+    return (int(start_time) // LEAGUE_ROTATION_SECONDS + 1) * \
+           LEAGUE_ROTATION_SECONDS
@@ -1,13 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import json
-
-from sqlalchemy import Column, String, create_engine, Integer, Boolean, Text
-from sqlalchemy.orm import sessionmaker
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import Column, String, create_engine, Integer, Boolean, \
+    Text, Float, ForeignKey, Index, UniqueConstraint, func, cast, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.ext.declarative import declarative_base
 
 import configs
+from sp2bot import metrics
 from sp2bot.models import User, BattlePoll
+from sp2bot.utils import jsoncodec
 
 # Create database
 Base = declarative_base()
@@ -31,13 +37,138 @@ class UserTable(Base):
     battle_poll = Column(Text(), nullable=True)
 
 
+class BattleTable(Base):
+    __tablename__ = 'battle'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'battle_number'),
+        Index('ix_battle_user_start_time', 'user_id', 'start_time'),
+        Index('ix_battle_user_rule', 'user_id', 'rule'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    battle_number = Column(String(), nullable=False)
+    start_time = Column(Integer, nullable=True)
+    battle_type = Column(String(), nullable=True)
+    rule = Column(String(), nullable=True)
+    game_mode = Column(String(), nullable=True)
+    victory = Column(Boolean(), nullable=False)
+    my_team_percentage = Column(Float(), nullable=True)
+    other_team_percentage = Column(Float(), nullable=True)
+    my_estimate_league_point = Column(Integer, nullable=True)
+    other_estimate_league_point = Column(Integer, nullable=True)
+
+    players = relationship('BattlePlayerTable', cascade='all, delete-orphan')
+
+
+class BattlePlayerTable(Base):
+    __tablename__ = 'battle_player'
+    __table_args__ = (
+        Index('ix_battle_player_user_weapon', 'user_id', 'weapon'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    battle_id = Column(Integer, ForeignKey('battle.id'), nullable=False,
+                       index=True)
+    # Owner of the battle, same as battle.user_id
+    user_id = Column(Integer, nullable=False)
+    # The owner's own row
+    me = Column(Boolean(), default=False)
+    my_team = Column(Boolean(), nullable=False)
+    principal_id = Column(String(), nullable=True, index=True)
+    nickname = Column(String(), nullable=True)
+    weapon = Column(String(), nullable=True)
+    udemae = Column(String(), nullable=True)
+    # Including assists, like SP2BattleResultMember.kill_count
+    kill_count = Column(Integer, nullable=True)
+    assist_count = Column(Integer, nullable=True)
+    death_count = Column(Integer, nullable=True)
+    special_count = Column(Integer, nullable=True)
+    game_paint_point = Column(Integer, nullable=True)
+
+
+class BattleCacheTable(Base):
+    __tablename__ = 'battle_cache'
+
+    principal_id = Column(String(), primary_key=True)
+    battle_number = Column(String(), primary_key=True)
+    data = Column(Text(), nullable=False)
+
+
+class AuthVerifierTable(Base):
+    __tablename__ = 'auth_verifier'
+
+    user_id = Column(Integer, primary_key=True)
+    verifier = Column(String(), nullable=False)
+    expires_at = Column(Float, nullable=False, index=True)
+
+
 engine = create_engine(configs.DATABASE_URI)
 
+
+# Time every statement for the metrics
+@event.listens_for(engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if context is not None:
+        context._sp2bot_started = time.monotonic()
+
+
+@event.listens_for(engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = getattr(context, '_sp2bot_started', None)
+    if started is not None:
+        metrics.observe('stage_seconds', time.monotonic() - started,
+                        stage='db', op=statement.split(None, 1)[0].lower())
+
+
 Base.metadata.create_all(engine)
 
 DBSession = sessionmaker(bind=engine)
 
 
+# User rows cached by id, None caches a missing user
+_user_cache = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+_USER_FIELDS = ('id', 'username', 'first_name', 'last_name', 'push',
+                'iksm_session', 'session_token', 'sp2_principal_id',
+                'sp2_nickname', 'sp2_style', 'sp2_species')
+
+
+def _user_row(u):
+    return {field: getattr(u, field) for field in _USER_FIELDS}
+
+
+def _user(row):
+    return User(**row)
+
+
+def _cached_user_row(user_id):
+    with _user_cache_lock:
+        if user_id not in _user_cache:
+            return False, None
+        _user_cache.move_to_end(user_id)
+        row = _user_cache[user_id]
+        return True, dict(row) if row else None
+
+
+def _cache_user_row(user_id, row):
+    with _user_cache_lock:
+        _user_cache[user_id] = row
+        _user_cache.move_to_end(user_id)
+        while len(_user_cache) > configs.USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+
+
+def _cache_user_push(user_id, push):
+    with _user_cache_lock:
+        row = _user_cache.get(user_id)
+        if row:
+            row['push'] = push
+
+
 def insert_user(user):
     session = DBSession()
     u = UserTable(id=user.id,
@@ -53,9 +184,12 @@ def insert_user(user):
                   sp2_species=user.sp2_user.species,
                   )
 
+    row = _user_row(u)
+
     session.add(u)
     session.commit()
     session.close()
+    _cache_user_row(user.id, row)
 
 
 def select_users_with_principal_ids(principal_ids):
@@ -64,75 +198,99 @@ def select_users_with_principal_ids(principal_ids):
         .filter(UserTable.sp2_principal_id.in_(principal_ids)).all()
     session.close()
 
-    users = []
-    for u in us:
-        users.append(User(u.id,
-                          u.first_name,
-                          username=u.username,
-                          last_name=u.last_name,
-                          push=u.push,
-                          iksm_session=u.iksm_session,
-                          session_token=u.session_token,
-                          sp2_principal_id=u.sp2_principal_id,
-                          sp2_nickname=u.sp2_nickname,
-                          sp2_style=u.sp2_style,
-                          sp2_species=u.sp2_species,
-                          ))
-    return users
+    return [_user(_user_row(u)) for u in us]
 
 
 def select_user(user_id):
+    cached, row = _cached_user_row(user_id)
+    if not cached:
+        session = DBSession()
+        u = session.get(UserTable, user_id)
+        session.close()
+
+        row = _user_row(u) if u else None
+        _cache_user_row(user_id, row)
+
+    return _user(row) if row else None
+
+
+def select_all_users():
     session = DBSession()
-    result = session.query(UserTable) \
-        .filter(UserTable.id == user_id)
-    u = result.one() if result.count() > 0 else None
+    us = session.query(UserTable).order_by(UserTable.id).all()
     session.close()
-    if u:
-        return User(u.id,
-                    u.first_name,
-                    username=u.username,
-                    last_name=u.last_name,
-                    push=u.push,
-                    iksm_session=u.iksm_session,
-                    session_token=u.session_token,
-                    sp2_principal_id=u.sp2_principal_id,
-                    sp2_nickname=u.sp2_nickname,
-                    sp2_style=u.sp2_style,
-                    sp2_species=u.sp2_species,
-                    )
-    else:
-        return None
 
+    return [_user(_user_row(u)) for u in us]
 
-def select_all_users():
+
+def select_users_with_session(after_user_id=0, limit=500):
+    # One page of users with a session, by id after `after_user_id`
     session = DBSession()
-    us = session.query(UserTable).all()
+    us = session.query(UserTable) \
+        .filter(UserTable.id > after_user_id,
+                UserTable.iksm_session.isnot(None),
+                UserTable.iksm_session != '') \
+        .order_by(UserTable.id) \
+        .limit(limit).all()
     session.close()
-    users = []
-    for u in us:
-        users.append(
-            User(u.id,
-                 u.first_name,
-                 username=u.username,
-                 last_name=u.last_name,
-                 push=u.push,
-                 iksm_session=u.iksm_session,
-                 session_token=u.session_token,
-                 sp2_principal_id=u.sp2_principal_id,
-                 sp2_nickname=u.sp2_nickname,
-                 sp2_style=u.sp2_style,
-                 sp2_species=u.sp2_species,
-                 )
-        )
-
-    return users
+
+    return [_user(_user_row(u)) for u in us]
+
+
+def count_users_with_session():
+    session = DBSession()
+    count = session.query(func.count(UserTable.id)) \
+        .filter(UserTable.iksm_session.isnot(None),
+                UserTable.iksm_session != '').scalar()
+    session.close()
+
+    return count
+
+
+def invalidate_sessions(iksm_sessions):
+    # Clears the given sessions of {user_id: iksm_session} in one UPDATE,
+    # a user who set a new session meanwhile keeps it
+    if not iksm_sessions:
+        return 0
+
+    session = DBSession()
+    count = session.query(UserTable) \
+        .filter(UserTable.id.in_(list(iksm_sessions)),
+                UserTable.iksm_session.in_(list(iksm_sessions.values()))) \
+        .update({UserTable.iksm_session: ''}, synchronize_session=False)
+    session.commit()
+    session.close()
+
+    with _user_cache_lock:
+        for user_id, iksm_session in iksm_sessions.items():
+            row = _user_cache.get(user_id)
+            if row and row['iksm_session'] == iksm_session:
+                row['iksm_session'] = ''
+
+    return count
 
 
 def update_user(user):
+    cached, row = _cached_user_row(user.id)
+
+    if cached and row:
+        new_row = dict(row,
+                       username=user.username,
+                       first_name=user.first_name,
+                       last_name=user.last_name,
+                       iksm_session=user.iksm_session,
+                       session_token=user.session_token)
+        if user.sp2_user:
+            new_row.update(sp2_principal_id=user.sp2_user.principal_id,
+                           sp2_nickname=user.sp2_user.nickname,
+                           sp2_style=user.sp2_user.style,
+                           sp2_species=user.sp2_user.species)
+
+        # Nothing changed
+        if new_row == row:
+            return
+
     session = DBSession()
-    result = session.query(UserTable) \
-        .filter(UserTable.id == user.id)
-    u = result.one() if result.count() > 0 else None
+    u = session.get(UserTable, user.id)
 
     if u:
         u.username = user.username
@@ -146,15 +304,16 @@ def update_user(user):
             u.sp2_style = user.sp2_user.style
             u.sp2_species = user.sp2_user.species
 
+    row = _user_row(u) if u else None
+
     session.commit()
     session.close()
+    _cache_user_row(user.id, row)
 
 
 def update_battle_poll(battle_poll):
     session = DBSession()
-    result = session.query(UserTable) \
-        .filter(UserTable.id == battle_poll.user.id)
-    u = result.one() if result.count() > 0 else None
+    u = session.get(UserTable, battle_poll.user.id)
 
     if u:
         u.push = True
@@ -162,6 +321,25 @@ def update_battle_poll(battle_poll):
 
     session.commit()
     session.close()
+    _cache_user_push(battle_poll.user.id, True)
+
+
+def update_battle_polls(battle_polls):
+    if not battle_polls:
+        return
+
+    session = DBSession()
+    session.bulk_update_mappings(UserTable, [
+        {'id': battle_poll.user.id,
+         'push': True,
+         'battle_poll': battle_poll.to_json()}
+        for battle_poll in battle_polls
+    ])
+    session.commit()
+    session.close()
+
+    for battle_poll in battle_polls:
+        _cache_user_push(battle_poll.user.id, True)
 
 
 def get_started_push_poll():
@@ -173,8 +351,9 @@ def get_started_push_poll():
     polls = []
     for u in us:
         if u.battle_poll:
-            poll_dict = json.loads(u.battle_poll)
+            poll_dict = jsoncodec.loads(u.battle_poll)
             poll = BattlePoll.de_json(poll_dict)
+            poll.mark_clean()
             polls.append(poll)
 
     return polls
@@ -182,12 +361,179 @@ def get_started_push_poll():
 
 def update_push_to_false(user_id):
     session = DBSession()
-    result = session.query(UserTable) \
-        .filter(UserTable.id == user_id)
-    u = result.one() if result.count() > 0 else None
+    u = session.get(UserTable, user_id)
 
     if u:
         u.push = False
 
     session.commit()
     session.close()
+    _cache_user_push(user_id, False)
+
+
+def select_cached_battle(principal_id, battle_number):
+    session = DBSession()
+    b = session.get(BattleCacheTable, (principal_id, battle_number))
+    session.close()
+
+    return b.data if b else None
+
+
+def insert_cached_battle(principal_id, battle_number, data):
+    session = DBSession()
+    session.merge(BattleCacheTable(principal_id=principal_id,
+                                   battle_number=battle_number,
+                                   data=data))
+    session.commit()
+    session.close()
+
+
+def insert_auth_verifier(user_id, verifier, expires_at):
+    session = DBSession()
+    # Expired ones of every user go too
+    session.query(AuthVerifierTable) \
+        .filter(AuthVerifierTable.expires_at <= time.time()) \
+        .delete(synchronize_session=False)
+    session.merge(AuthVerifierTable(user_id=user_id,
+                                    verifier=verifier,
+                                    expires_at=expires_at))
+    session.commit()
+    session.close()
+
+
+def select_auth_verifier(user_id):
+    session = DBSession()
+    v = session.get(AuthVerifierTable, user_id)
+    session.close()
+
+    if v and v.expires_at > time.time():
+        return v.verifier
+    return None
+
+
+def delete_auth_verifier(user_id):
+    session = DBSession()
+    session.query(AuthVerifierTable) \
+        .filter(AuthVerifierTable.user_id == user_id) \
+        .delete(synchronize_session=False)
+    session.commit()
+    session.close()
+
+
+def _battle_player_row(user_id, member, my_team, me=False):
+    player = member.player
+    return BattlePlayerTable(
+        user_id=user_id,
+        me=me,
+        my_team=my_team,
+        principal_id=player.principal_id,
+        nickname=player.nickname,
+        weapon=player.weapon.name if player.weapon else None,
+        udemae=player.udemae.name if player.udemae else None,
+        kill_count=member.kill_count,
+        assist_count=member.assist_count,
+        death_count=member.death_count,
+        special_count=member.special_count,
+        game_paint_point=member.game_paint_point,
+    )
+
+
+def _battle_row(user_id, battle):
+    me = battle.player_result
+    players = [_battle_player_row(user_id, me, True, me=True)]
+    for members, my_team in ((battle.my_team_members, True),
+                             (battle.other_team_members, False)):
+        for member in members or []:
+            if member is not me:
+                players.append(_battle_player_row(user_id, member, my_team))
+
+    return BattleTable(
+        user_id=user_id,
+        battle_number=str(battle.battle_number),
+        start_time=battle.start_time,
+        battle_type=battle.battle_type,
+        rule=battle.rule.key if battle.rule else None,
+        game_mode=battle.game_mode,
+        victory=battle.victory,
+        my_team_percentage=battle.my_team_percentage,
+        other_team_percentage=battle.other_team_percentage,
+        my_estimate_league_point=battle.my_estimate_league_point,
+        other_estimate_league_point=battle.other_estimate_league_point,
+        players=players,
+    )
+
+
+def select_battle_numbers(user_id, battle_numbers):
+    session = DBSession()
+    rows = session.query(BattleTable.battle_number) \
+        .filter(BattleTable.user_id == user_id,
+                BattleTable.battle_number.in_(
+                    [str(n) for n in battle_numbers])).all()
+    session.close()
+
+    return {row.battle_number for row in rows}
+
+
+def insert_battles(user_id, battles):
+    stored = select_battle_numbers(user_id,
+                                   [b.battle_number for b in battles])
+    battles = [b for b in battles if str(b.battle_number) not in stored]
+    if not battles:
+        return 0
+
+    session = DBSession()
+    try:
+        # Unique by battle_number, the last one wins
+        rows = {str(b.battle_number): b for b in battles}
+        session.add_all([_battle_row(user_id, b) for b in rows.values()])
+        session.commit()
+        return len(rows)
+    except IntegrityError:
+        # Inserted meanwhile by the push loop or a backfill, one
+        # savepoint per battle skips those
+        session.rollback()
+        count = 0
+        for battle in rows.values():
+            try:
+                with session.begin_nested():
+                    session.add(_battle_row(user_id, battle))
+                count += 1
+            except IntegrityError:
+                pass
+        session.commit()
+        return count
+    finally:
+        session.close()
+
+
+def select_battle_stats(user_id, rule=None, weapon=None, since=None):
+    session = DBSession()
+    query = session.query(
+        func.count(BattleTable.id),
+        func.sum(cast(BattleTable.victory, Integer)),
+        func.avg(BattlePlayerTable.kill_count),
+        func.avg(BattlePlayerTable.assist_count),
+        func.avg(BattlePlayerTable.death_count),
+        func.avg(BattlePlayerTable.special_count),
+    ).join(BattlePlayerTable, BattlePlayerTable.battle_id == BattleTable.id) \
+        .filter(BattleTable.user_id == user_id,
+                BattlePlayerTable.me == True)
+
+    if rule:
+        query = query.filter(BattleTable.rule == rule)
+    if weapon:
+        query = query.filter(BattlePlayerTable.weapon == weapon)
+    if since:
+        query = query.filter(BattleTable.start_time >= since)
+
+    count, victory_count, kill, assist, death, special = query.one()
+    session.close()
+
+    return {
+        'count': count,
+        'victory_count': victory_count or 0,
+        'kill_count_average': float(kill or 0),
+        'assist_count_average': float(assist or 0),
+        'death_count_average': float(death or 0),
+        'special_count_average': float(special or 0),
+    }
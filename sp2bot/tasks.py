@@ -1,51 +1,119 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from telegram.error import BadRequest
 from telegram.ext import CallbackContext
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import configs
-from sp2bot import store
-from sp2bot.message import Message
-from sp2bot.splatoon2 import Splatoon2, Splatoon2SessionInvalid
+from sp2bot import metrics, store
+from sp2bot.backfill import Backfill
+from sp2bot.fanout import SharedBattles
+from sp2bot.keepalive import KeepAlive
+from sp2bot.medals import MedalTracker
+from sp2bot.message import Message, MessageType
+from sp2bot.poller import PollJob, PollScheduler
+from sp2bot.sender import sender
+from sp2bot.splatoon2 import Splatoon2, Splatoon2Error, \
+    Splatoon2SessionInvalid
 
 
 class Task:
 
     def __init__(self, job_queue=None):
-        self._battle_pools = []
+        # Push jobs by user id, other repeating jobs apart
+        self._push_jobs = {}
+        self._push_jobs_lock = threading.Lock()
         self._jobs = []
         self.job_queue = job_queue
+        self._flush_lock = threading.Lock()
+        self._backfill = Backfill(concurrency=configs.BACKFILL_CONCURRENCY)
+        # Battle details of one poll fetched in parallel
+        self._battle_executor = ThreadPoolExecutor(
+            max_workers=configs.BATTLE_PUSH_WORKERS,
+            thread_name_prefix='battle'
+        )
+        self._shared_battles = SharedBattles()
+        self._keep_alive = KeepAlive(
+            period=configs.KEEP_ALIVE_INTERVAL,
+            slice_interval=configs.KEEP_ALIVE_SLICE_INTERVAL,
+            concurrency=configs.KEEP_ALIVE_CONCURRENCY,
+            page_size=configs.KEEP_ALIVE_PAGE_SIZE,
+            fresh_for=configs.KEEP_ALIVE_FRESH_FOR
+        )
+        self._medals = MedalTracker(
+            retry_interval=configs.MEDAL_RETRY_INTERVAL,
+            give_up_after=configs.MEDAL_GIVE_UP_AFTER
+        )
+        self._poller = PollScheduler(interval=configs.BATTLE_PUSH_INTERVAL,
+                                     max_rate=configs.BATTLE_PUSH_MAX_RATE,
+                                     workers=configs.BATTLE_PUSH_WORKERS)
+
+    @property
+    def poll_metrics(self):
+        return self._poller.last_metrics
+
+    @property
+    def shared_battle_stats(self):
+        return self._shared_battles.stats
+
+    @property
+    def keep_alive_stats(self):
+        return self._keep_alive.stats
+
+    @property
+    def medal_stats(self):
+        return self._medals.stats
+
+    @property
+    def push_job_count(self):
+        return len(self._push_jobs)
 
     def task_exist(self, user_id):
         return self.get_job(user_id) is not None
 
     def get_job(self, user_id):
-        # print(f'Query job with user_id: {user_id}')
-        # print([j.name for j in self.job_queue.jobs()])
-
-        all_jobs = self._jobs
-        # all_jobs = self.job_queue.jobs()
-        jobs = [j for j in all_jobs if j.name == str(user_id) and not j.removed]
-        # print('Not removed jobs:')
-        # print([j.name for j in jobs])
-        if jobs and len(jobs) > 0:
-            return jobs[0]
+        job = self._push_jobs.get(str(user_id))
+        if job and not job.removed:
+            return job
         return None
 
     def stop_push(self, user_id):
-        job = self.get_job(user_id)
+        with self._push_jobs_lock:
+            job = self._push_jobs.pop(str(user_id), None)
         if job:
-            job.schedule_removal()
+            self._poller.remove(job)
+        self._medals.forget(user_id)
 
-        store.update_push_to_false(user_id)
+        # Not racing a flush that still sees the job
+        with self._flush_lock:
+            store.update_push_to_false(user_id)
 
     def start_all_user_keep_alive_task(self):
-        job = self.job_queue.run_repeating(self._all_user_keep_alive,
-                                           interval=21600,
+        job = self.job_queue.run_repeating(
+            self._all_user_keep_alive,
+            interval=configs.KEEP_ALIVE_SLICE_INTERVAL,
+            first=0,
+            name="keep_alive"
+        )
+        self._jobs.append(job)
+
+    def start_battle_poll_task(self):
+        job = self.job_queue.run_repeating(self._battle_poll_tick,
+                                           interval=self._poller.resolution,
                                            first=0,
-                                           name="keep_alive")
+                                           name="battle_poll")
+        self._jobs.append(job)
+
+    def start_battle_poll_flush_task(self):
+        job = self.job_queue.run_repeating(
+            self._battle_poll_flush_task,
+            interval=configs.BATTLE_POLL_FLUSH_INTERVAL,
+            first=configs.BATTLE_POLL_FLUSH_INTERVAL,
+            name="battle_poll_flush"
+        )
         self._jobs.append(job)
 
     def load_and_run_all_push_job(self):
@@ -53,140 +121,316 @@ class Task:
             self.start_battle_push(battle_poll)
 
     def start_battle_push(self, battle_poll):
-        if self.task_exist(battle_poll.user.id):
+        with self._push_jobs_lock:
+            if self.task_exist(battle_poll.user.id):
+                return
+
+            # Update poll to database
+            store.update_battle_poll(battle_poll)
+
+            # Import the battles played before push started. A restored
+            # poll already pushed them, its gap is fetched by the poll
+            if not battle_poll.last_battle_number:
+                self._backfill.submit(battle_poll.user)
+
+            job_params = (battle_poll,
+                          Splatoon2.for_user(battle_poll.user))
+            job = PollJob(str(battle_poll.user.id),
+                          self._battle_push_task,
+                          interval=self._poll_interval(battle_poll),
+                          context=job_params)
+            self._push_jobs[job.name] = job
+        self._poller.add(job)
+
+    def wake_push(self, user_id):
+        job = self.get_job(user_id)
+        if not job:
             return
 
-        # Update poll to database
-        store.update_battle_poll(battle_poll)
+        (battle_poll, _) = job.context
+        if battle_poll.poll_interval is None:
+            return
 
-        self._battle_pools.append(battle_poll)
+        battle_poll.reset_poll_interval()
+        job.interval = self._poll_interval(battle_poll)
+        self._poller.wake(job)
 
-        job_params = (battle_poll,
-                      Splatoon2(battle_poll.user.iksm_session))
-        job = self.job_queue.run_repeating(self._battle_push_task,
-                                           interval=10,
-                                           first=0,
-                                           context=job_params,
-                                           name=str(battle_poll.user.id))
-        self._jobs.append(job)
+    def flush_battle_polls(self):
+        with self._flush_lock:
+            with self._push_jobs_lock:
+                jobs = list(self._push_jobs.values())
+            battle_polls = [j.context[0] for j in jobs
+                            if not j.removed and j.context[0].dirty]
 
-    def _battle_push_task(self, context: CallbackContext):
-        (battle_poll, splatoon2) = context.job.context
+            # Clean first, changes while writing mark it dirty again
+            for battle_poll in battle_polls:
+                battle_poll.mark_clean()
+
+            try:
+                store.update_battle_polls(battle_polls)
+            except:
+                for battle_poll in battle_polls:
+                    battle_poll.mark_dirty()
+                raise
+
+        return len(battle_polls)
+
+    def backfill_all(self, after_user_id=None):
+        return self._backfill.run_all(after_user_id)
+
+    def shutdown(self):
+        self._poller.shutdown(wait=False)
+        self._battle_executor.shutdown(wait=False)
+        self._backfill.shutdown()
+        self._keep_alive.shutdown()
+        self.flush_battle_polls()
+
+    def _battle_poll_tick(self, context: CallbackContext):
+        tick_metrics = self._poller.tick()
+        if configs.DEBUG and tick_metrics.due:
+            print(f'Battle poll tick: {tick_metrics.to_dict()}')
+
+    def _battle_poll_flush_task(self, context: CallbackContext):
+        count = self.flush_battle_polls()
+        if configs.DEBUG and count:
+            print(f'Flushed battle polls: {count}')
+
+    def _battle_push_task(self, job: PollJob):
+        started = time.monotonic()
+        result = 'error'
+        try:
+            result = self._push_battles(job)
+        finally:
+            metrics.observe('push_seconds', time.monotonic() - started)
+            metrics.inc('push_total', result=result)
+
+    def _push_battles(self, job: PollJob):
+        # Returns the outcome for the metrics
+        (battle_poll, splatoon2) = job.context
 
         last_message_id = battle_poll.last_message_id
         last_battle_number = battle_poll.last_battle_number
-        bot = context.bot
+        rank_changed_messages = []
+        push_message = None
+        deferred = False
 
-        # Get last battle detail
+        # Get battles newer than the last pushed one
         try:
-            battle_overview = splatoon2.get_battle_overview()
+            battle_overview = splatoon2.get_battle_overview(
+                since=last_battle_number,
+                limit=None if last_battle_number else 1
+            )
         except Splatoon2SessionInvalid:
             # Stop
             self.stop_push(battle_poll.user.id)
-            return
+            return 'session_invalid'
         except:
             self.stop_push(battle_poll.user.id)
-            return
-
-        if len(battle_overview.results) == 0:
-            return
-        last_battle = battle_overview.results[0]
-
-        if configs.DEBUG:
-            print(f'Load battle: {last_battle.battle_number}')
-
-        if last_battle_number and \
-                last_battle_number != last_battle.battle_number:
-
-            print(f'Found new battle: {last_battle.battle_number}')
-
-            battle = splatoon2.get_battle(last_battle.battle_number)
-
-            rank = battle.player_result.player.udemae
-
-            if battle_poll.last_battle_udemae and \
-                    battle_poll.last_battle_rule == battle.rule.key and \
-                    (battle_poll.last_battle_udemae.name != rank.name or \
-                     (battle_poll.last_battle_udemae.name == rank.name and
-                      battle_poll.last_battle_udemae.s_plus_number != rank.s_plus_number)):
-                content, parse_mode = Message.rank_changed(
-                    battle.rule.name,
-                    battle.player_result.player.nickname,
-                    battle_poll.last_battle_udemae,
-                    rank
-                )
-                bot.send_message(
-                    battle_poll.chat.id,
-                    content,
-                    parse_mode=parse_mode
-                )
-
-            # Update poll
-            battle_poll.game_count += 1
-            battle_poll.game_victory_count += int(battle.victory)
-            battle_poll.last_battle_number = battle.battle_number
-            battle_poll.last_battle_udemae = rank
-            battle_poll.last_battle_rule = battle.rule.key
-            # Save updated to context
-            context.job.context = (battle_poll, splatoon2)
-
-            # Menus
-            buttons = [[
-                InlineKeyboardButton('👍',
-                                     callback_data=f'battle_like/{battle_poll.user.id}'),
-                InlineKeyboardButton('🖼',
-                                     callback_data=f'battle_detail/{battle_poll.user.id}/{last_battle.battle_number}')
-            ]]
-            reply_markup = InlineKeyboardMarkup(buttons)
-
-            # Send push message
-            (content, message_type) = Message.push_battle(battle, battle_poll)
-            parse_mode = message_type if message_type else None
-
+            return 'stopped'
+
+        new_battles = battle_overview.results
+        if not last_battle_number and len(new_battles) == 0:
+            splatoon2.save_validators()
+            return 'none'
+
+        # Back off while nothing new is played
+        if len(new_battles) == 0:
+            battle_poll.back_off(configs.BATTLE_PUSH_INTERVAL,
+                                 configs.BATTLE_PUSH_MAX_INTERVAL,
+                                 configs.BATTLE_PUSH_BACKOFF_AFTER)
+        else:
+            battle_poll.reset_poll_interval()
+        job.interval = self._poll_interval(battle_poll)
+
+        if last_battle_number and len(new_battles) > 0:
+            print(f'Found new battles: '
+                  f'{[b.battle_number for b in new_battles]}')
+
+            # Oldest first, battles a pusher in this chat already posted
+            # are neither fetched nor pushed again. Ones still being
+            # posted are left for the next poll
+            overview_battles = list(reversed(new_battles))
+            claims, shared, overview_battles = self._claim_battles(
+                battle_poll.chat, splatoon2.principal_id, overview_battles)
+            deferred = len(overview_battles) < len(new_battles)
+
+            # Fetch every other new battle at once
+            battle_numbers = [b.battle_number for b in overview_battles
+                              if b.battle_number not in shared]
             try:
-                sent_message = bot.send_message(battle_poll.chat.id,
-                                                content,
-                                                parse_mode=parse_mode,
-                                                reply_markup=reply_markup)
-            except BadRequest as e:
-                # Resend
-                sent_message = bot.send_message(battle_poll.chat.id,
-                                                content,
-                                                reply_markup=reply_markup)
-
-            # Update value
-            battle_poll.last_message_id = sent_message.message_id
-            # Save updated to context
-            context.job.context = (battle_poll, splatoon2)
+                fetched = dict(zip(battle_numbers,
+                                   self._battle_executor.map(
+                                       splatoon2.get_battle, battle_numbers)))
+                for battle_number, claim in claims.items():
+                    claim.set_result(_principal_ids(fetched[battle_number]))
+            finally:
+                for claim in claims.values():
+                    if not claim.done():
+                        claim.set_exception(Splatoon2Error('Not fetched'))
+
+            # Shared battles keep the overview, it has everything the
+            # statistics need
+            battles = [fetched.get(b.battle_number, b)
+                       for b in overview_battles]
+
+            # Keep battle history
+            try:
+                store.insert_battles(battle_poll.user.id, battles)
+            except Exception as e:
+                print(f'Exception, insert_battles: {e}')
+
+            for battle in battles:
+                rank = battle.player_result.player.udemae
+
+                if battle_poll.last_battle_udemae and \
+                        battle_poll.last_battle_rule == battle.rule.key and \
+                        (battle_poll.last_battle_udemae.name != rank.name or \
+                         (battle_poll.last_battle_udemae.name == rank.name and
+                          battle_poll.last_battle_udemae.s_plus_number != rank.s_plus_number)):
+                    rank_changed_messages.append(Message.rank_changed(
+                        battle.rule.name,
+                        battle.player_result.player.nickname,
+                        battle_poll.last_battle_udemae,
+                        rank
+                    ))
+
+                # Update poll
+                battle_poll.record_battle(battle)
 
-            # Delete
-            if last_message_id and battle_poll.chat.type != 'private':
-                bot.delete_message(battle_poll.chat.id, last_message_id)
+            # Save updated to context
+            job.context = (battle_poll, splatoon2)
+
+            pushed_battles = [b for b in battles if b.battle_number in fetched]
+            if pushed_battles:
+                # Menus
+                last_battle = pushed_battles[-1]
+                buttons = [[
+                    InlineKeyboardButton('👍',
+                                         callback_data=f'battle_like/{battle_poll.user.id}'),
+                    InlineKeyboardButton('🖼',
+                                         callback_data=f'battle_detail/{battle_poll.user.id}/{last_battle.battle_number}')
+                ]]
+                reply_markup = InlineKeyboardMarkup(buttons)
+
+                # Push message, earlier battles as a digest
+                highlights = self._highlights(battle_poll.chat, last_battle)
+                with metrics.span('render', op='push_battles'):
+                    push_message = Message.push_battles(
+                        pushed_battles, battle_poll, highlights
+                    )
 
         elif not last_battle_number:
-            battle_poll.last_battle_number = last_battle.battle_number
+            battle_poll.last_battle_number = new_battles[0].battle_number
             # Save updated to context
-            context.job.context = (battle_poll, splatoon2)
+            job.context = (battle_poll, splatoon2)
+
+        # Every battle of the overview is recorded, a 304 may answer the
+        # next poll. A failed fetch raised before this, and deferred
+        # battles need the overview again, so both are retried
+        if not deferred:
+            splatoon2.save_validators()
+
+        medal_msg_content = self._medals.check(battle_poll, splatoon2)
+
+        # Notices stay, the sender merges them into one message. The push
+        # goes on its own since the next push in a group deletes it
+        chat_id = battle_poll.chat.id
+        if rank_changed_messages:
+            sender.send_message(
+                chat_id,
+                '\n'.join(c for c, _ in rank_changed_messages),
+                parse_mode=rank_changed_messages[0][1],
+                coalesce=True
+            )
 
-        medal_msg_content = Message.medal_msg(battle_poll, splatoon2)
         if medal_msg_content:
-            bot.send_message(battle_poll.chat.id, medal_msg_content, parse_mode='Markdown')
+            sender.send_message(chat_id,
+                                medal_msg_content,
+                                parse_mode=MessageType.HTML,
+                                coalesce=True)
 
-        store.update_battle_poll(battle_poll)
+        if push_message:
+            (content, message_type) = push_message
+            parse_mode = message_type if message_type else None
 
-    def _all_user_keep_alive(self, context: CallbackContext):
-        all_users = store.select_all_users()
-        for user in all_users:
-            if not user.iksm_session or user.iksm_session == '':
+            def on_sent(future):
+                if future.exception():
+                    return
+
+                # Update value
+                battle_poll.last_message_id = future.result().message_id
+
+                # Delete
+                if last_message_id and battle_poll.chat.type != 'private':
+                    sender.delete_message(chat_id, last_message_id)
+
+            future = sender.send_message(chat_id,
+                                         content,
+                                         parse_mode=parse_mode,
+                                         reply_markup=reply_markup)
+            future.add_done_callback(on_sent)
+
+        if not last_battle_number:
+            return 'first'
+        return 'new' if new_battles else 'none'
+
+    def _claim_battles(self, chat, principal_id, battles):
+        # Claims for the battles this pusher posts, the numbers of the
+        # ones another pusher in the chat already posted, and the battles
+        # to handle now, up to the first one another pusher is posting
+        claims, shared = {}, set()
+        if chat.type == 'private':
+            return claims, shared, battles
+
+        for index, battle in enumerate(battles):
+            if battle.start_time is None:
                 continue
-
-            # Get last battle detail
-            try:
-                splatoon2 = Splatoon2(user.iksm_session)
-                _ = splatoon2.get_battle_overview()
-            except Splatoon2SessionInvalid:
-                user.iksm_session = ''
-                store.update_user(user)
-                continue
-            except:
+            claim = self._shared_battles.claim(chat.id, battle.start_time)
+            if claim:
+                claims[battle.battle_number] = claim
                 continue
+
+            played = self._shared_battles.played_in_claimed(
+                chat.id, battle.start_time, principal_id)
+            if played is None:
+                return claims, shared, battles[:index]
+            if played:
+                shared.add(battle.battle_number)
+
+        return claims, shared, battles
+
+    @staticmethod
+    def _highlights(chat, battle):
+        # Every registered player of a battle pushed to a group
+        if chat.type == 'private':
+            return ()
+
+        try:
+            users = store.select_users_with_principal_ids(
+                list(_principal_ids(battle)))
+        except Exception as e:
+            print(f'Exception, select_users_with_principal_ids: {e}')
+            return ()
+        return {u.sp2_user.principal_id for u in users if u.sp2_user}
+
+    @staticmethod
+    def _poll_interval(battle_poll):
+        return battle_poll.poll_interval or configs.BATTLE_PUSH_INTERVAL
+
+    def _all_user_keep_alive(self, context: CallbackContext):
+        # One slice of the sweep, off the job queue thread
+        def done(future):
+            if future.exception():
+                print(f'Exception, keep alive: {future.exception()}')
+                return
+            report = future.result()
+            if configs.DEBUG and (report.checked or report.skipped):
+                print(f'Keep alive: {report}')
+
+        self._keep_alive.submit().add_done_callback(done)
+
+
+def _principal_ids(battle):
+    return {m.player.principal_id
+            for m in (battle.my_team_members or []) +
+            (battle.other_team_members or [])}
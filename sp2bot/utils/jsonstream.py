@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import re
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+# Lazily decode the items of the array `key` of a JSON object string.
+# Top level values before it are decoded to be skipped, the rest of the
+# document is never parsed.
+# Raises ValueError when the array is not found.
+def iter_array(s, key):
+    idx = _skip(s, 0)
+    if s[idx:idx + 1] != '{':
+        raise ValueError('Not a JSON object')
+    idx = _skip(s, idx + 1)
+
+    while True:
+        if s[idx:idx + 1] != '"':
+            raise ValueError(f'Array "{key}" not found')
+        name, idx = _decoder.raw_decode(s, idx)
+        idx = _skip(s, idx)
+        if s[idx:idx + 1] != ':':
+            raise ValueError('Invalid JSON object')
+        idx = _skip(s, idx + 1)
+
+        if name == key:
+            break
+
+        # Some other value, nested "key"s included
+        _, idx = _decoder.raw_decode(s, idx)
+        idx = _skip(s, idx)
+        if s[idx:idx + 1] != ',':
+            raise ValueError(f'Array "{key}" not found')
+        idx = _skip(s, idx + 1)
+
+    if s[idx:idx + 1] != '[':
+        raise ValueError(f'Array "{key}" not found')
+    idx = _skip(s, idx + 1)
+
+    if s[idx:idx + 1] == ']':
+        return
+
+    while True:
+        item, idx = _decoder.raw_decode(s, idx)
+        yield item
+
+        idx = _skip(s, idx)
+        sep = s[idx:idx + 1]
+        if sep == ']':
+            return
+        if sep != ',':
+            raise ValueError(f'Invalid array "{key}"')
+        idx = _skip(s, idx + 1)
+
+
+def _skip(s, idx):
+    return _whitespace.match(s, idx).end()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Telegram HTML parse mode helpers
+import re
+from html import escape
+
+# Tags and attributes Telegram accepts
+ALLOWED_TAGS = {
+    'b': (), 'strong': (), 'i': (), 'em': (), 'u': (), 'ins': (),
+    's': (), 'strike': (), 'del': (), 'tg-spoiler': (), 'span': ('class',),
+    'a': ('href',), 'code': ('class',), 'pre': (),
+}
+
+_TOKEN = re.compile(
+    r'<(?P<close>/?)(?P<tag>[a-z-]+)(?P<attrs>(?:\s+[a-z-]+="[^"<>]*")*)\s*>'
+    r'|&(?:lt|gt|amp|quot|#\d+|#x[0-9a-fA-F]+);'
+    r'|(?P<bare>[<>&])'
+)
+_ATTR = re.compile(r'([a-z-]+)="[^"<>]*"')
+
+
+def escape_html(text):
+    return escape(str(text), quote=True)
+
+
+def code(text):
+    return f'<code>{escape_html(text)}</code>'
+
+
+def bold(text):
+    return f'<b>{escape_html(text)}</b>'
+
+
+# True when Telegram will accept `text` with parse_mode HTML
+def validate_html(text):
+    stack = []
+    for match in _TOKEN.finditer(text):
+        if match.group('bare'):
+            return False
+
+        tag = match.group('tag')
+        if not tag:
+            continue
+        if tag not in ALLOWED_TAGS:
+            return False
+
+        if match.group('close'):
+            if match.group('attrs') or not stack or stack.pop() != tag:
+                return False
+            continue
+
+        # Only pre > code may nest inside code blocks
+        if stack and stack[-1] in ('code', 'pre') and \
+                not (stack[-1] == 'pre' and tag == 'code'):
+            return False
+        for attr in _ATTR.findall(match.group('attrs')):
+            if attr not in ALLOWED_TAGS[tag]:
+                return False
+        stack.append(tag)
+
+    return not stack
@@ -3,13 +3,18 @@
 
 
 # Decode and encode model
-import json
+from sp2bot.utils import jsoncodec
+from collections.abc import Sequence
+
+
+_fields_cache = {}
 
 
 class Model:
+    __slots__ = ()
 
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return jsoncodec.dumps(self.to_dict())
 
     @classmethod
     def de_json(cls, data):
@@ -20,14 +25,28 @@ class Model:
 
         return data
 
+    @classmethod
+    def _fields(cls):
+        fields = _fields_cache.get(cls)
+        if fields is None:
+            fields = tuple(key for klass in reversed(cls.__mro__)
+                           for key in getattr(klass, '__slots__', ()))
+            _fields_cache[cls] = fields
+        return fields
+
     def to_dict(self):
         data = dict()
 
-        for key in iter(self.__dict__):
-            if key in ():
+        keys = self._fields()
+        if hasattr(self, '__dict__'):
+            keys = keys + tuple(self.__dict__)
+
+        for key in keys:
+            # Private state is never serialized
+            if key.startswith('_'):
                 continue
 
-            value = self.__dict__[key]
+            value = getattr(self, key, None)
             if value is not None:
                 if hasattr(value, 'to_dict'):
                     data[key] = value.to_dict()
@@ -35,3 +54,68 @@ class Model:
                     data[key] = value
 
         return data
+
+
+# Model decoded on first access of a field not in `fields`,
+# `fields` maps cheap field names to functions of the raw data.
+class LazyModel:
+    # No __dict__, overviews hold dozens of these
+    __slots__ = ('_decode', '_fields', '_raw', '_cache', '_model')
+
+    def __init__(self, decode, data, fields=None):
+        self._decode = decode
+        self._fields = fields or {}
+        self._raw = data
+        # Cheap fields read so far, created on first read
+        self._cache = None
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = self._decode(self._raw)
+            self._raw = None
+            self._cache = None
+        return self._model
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        field = self._fields.get(name)
+        if field and self._model is None:
+            if self._cache is None:
+                self._cache = {}
+            elif name in self._cache:
+                return self._cache[name]
+            value = self._cache[name] = field(self._raw)
+            return value
+
+        return getattr(self.model, name)
+
+    def to_dict(self):
+        return self.model.to_dict()
+
+    def to_json(self):
+        return self.model.to_json()
+
+
+# List decoding each item on first access
+class LazyList(Sequence):
+
+    def __init__(self, data, decode):
+        self._data = data or []
+        self._decode = decode
+        self._items = [None] * len(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        item = self._items[index]
+        if item is None:
+            item = self._items[index] = self._decode(self._data[index])
+        return item
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import OrderedDict
+
+import configs
+from sp2bot import store
+
+
+class MemoryVerifierStore:
+    """PKCE code verifiers by user id, kept between /gettoken and the
+    pasted login link for `ttl` seconds. Only this process sees them."""
+
+    def __init__(self, ttl=600, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._verifiers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._verifiers)
+
+    def put(self, user_id, verifier):
+        now = time.time()
+        with self._lock:
+            self._verifiers.pop(user_id, None)
+            self._verifiers[user_id] = (verifier, now + self.ttl)
+
+            # Oldest first, every ttl is the same
+            while self._verifiers:
+                _, (_, expires_at) = next(iter(self._verifiers.items()))
+                if expires_at > now and \
+                        len(self._verifiers) <= self.max_entries:
+                    break
+                self._verifiers.popitem(last=False)
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._verifiers.get(user_id)
+        if entry and entry[1] > time.time():
+            return entry[0]
+        return None
+
+    def discard(self, user_id):
+        with self._lock:
+            self._verifiers.pop(user_id, None)
+
+
+class SQLVerifierStore:
+    """Same as MemoryVerifierStore in the auth_verifier table, so they
+    survive a restart and every bot process sharing the database sees
+    them."""
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+
+    def put(self, user_id, verifier):
+        store.insert_auth_verifier(user_id,
+                                   verifier.decode('ascii'),
+                                   time.time() + self.ttl)
+
+    def get(self, user_id):
+        verifier = store.select_auth_verifier(user_id)
+        return verifier.encode('ascii') if verifier else None
+
+    def discard(self, user_id):
+        store.delete_auth_verifier(user_id)
+
+
+if configs.AUTH_VERIFIER_STORE == 'sql':
+    auth_verifiers = SQLVerifierStore(ttl=configs.AUTH_VERIFIER_TTL)
+else:
+    auth_verifiers = MemoryVerifierStore(ttl=configs.AUTH_VERIFIER_TTL)
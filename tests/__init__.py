@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+# The store opens DATABASE_URL on import, tests get a throwaway SQLite file
+if not os.environ.get('DATABASE_URL'):
+    _fd, _path = tempfile.mkstemp(prefix='sp2bot-test-', suffix='.db')
+    os.close(_fd)
+    os.environ['DATABASE_URL'] = f'sqlite:///{_path}'
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+
+from benchmarks import payloads
+from sp2bot import store
+from sp2bot.backfill import Backfill
+from sp2bot.models import User
+from sp2bot.splatoon2models import SP2BattleOverview, SP2BattleResult
+
+
+def _battle(battle_number):
+    return SP2BattleResult.de_json(
+        payloads.battle_detail(seed=battle_number, battle_number=battle_number))
+
+
+class Splatoon2Stub:
+    # Lists five battles, the ones in `broken` fail to download
+
+    def __init__(self, broken=()):
+        self.broken = broken
+        self.downloaded = []
+
+    def get_battle_overview(self):
+        return SP2BattleOverview.de_json(payloads.results(count=5))
+
+    def get_battle(self, battle_number, cache=True):
+        self.downloaded.append(battle_number)
+        if battle_number in self.broken:
+            raise Exception('500')
+        return _battle(int(battle_number))
+
+
+class InsertBattlesTest(unittest.TestCase):
+
+    def test_skips_stored_battles(self):
+        self.assertEqual(store.insert_battles(101, [_battle(1), _battle(2)]),
+                         2)
+        self.assertEqual(store.insert_battles(101, [_battle(2), _battle(3)]),
+                         1)
+        self.assertEqual(store.insert_battles(101, [_battle(3)]), 0)
+        self.assertEqual(store.select_battle_numbers(101, [1, 2, 3, 4]),
+                         {'1', '2', '3'})
+
+    def test_battles_inserted_meanwhile(self):
+        store.insert_battles(102, [_battle(2)])
+
+        # Stored by someone else between the lookup and the insert
+        with mock.patch.object(store, 'select_battle_numbers',
+                               return_value=set()):
+            inserted = store.insert_battles(
+                102, [_battle(1), _battle(2), _battle(3)])
+
+        self.assertEqual(inserted, 2)
+        self.assertEqual(store.select_battle_numbers(102, [1, 2, 3]),
+                         {'1', '2', '3'})
+
+    def test_battle_stats(self):
+        battles = [_battle(n) for n in range(1, 6)]
+        store.insert_battles(103, battles)
+
+        stats = store.select_battle_stats(103)
+        self.assertEqual(stats['count'], 5)
+        self.assertEqual(stats['victory_count'],
+                         sum(1 for b in battles if b.victory))
+        self.assertAlmostEqual(
+            stats['kill_count_average'],
+            sum(b.player_result.kill_count for b in battles) / 5)
+
+        rule = battles[0].rule.key
+        self.assertEqual(store.select_battle_stats(103, rule=rule)['count'],
+                         sum(1 for b in battles if b.rule.key == rule))
+        self.assertEqual(store.select_battle_stats(104)['count'], 0)
+
+
+class BackfillTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backfill = Backfill(concurrency=2)
+
+    def tearDown(self):
+        self.backfill.shutdown()
+
+    def _run(self, user, splatoon2):
+        with mock.patch('sp2bot.backfill.Splatoon2.for_user',
+                        return_value=splatoon2):
+            return self.backfill.run(user)
+
+    def test_imports_missing_battles(self):
+        user = User(201, 'backfill')
+        store.insert_battles(user.id, [_battle(5000)])
+
+        splatoon2 = Splatoon2Stub(broken=('4997',))
+        report = self._run(user, splatoon2)
+        self.assertEqual((report.listed, report.skipped, report.inserted,
+                          report.failed), (5, 1, 3, 1))
+        self.assertNotIn('5000', splatoon2.downloaded)
+
+        # Run again, only the failed one is left
+        splatoon2 = Splatoon2Stub()
+        report = self._run(user, splatoon2)
+        self.assertEqual(splatoon2.downloaded, ['4997'])
+        self.assertEqual((report.skipped, report.inserted), (4, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
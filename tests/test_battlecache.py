@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from benchmarks import payloads
+from sp2bot.battlecache import BattleCache
+from sp2bot.splatoon2models import SP2BattleResult
+
+
+def _raw(battle_number):
+    return json.dumps(payloads.battle_detail(
+        seed=battle_number, battle_number=battle_number)).encode('utf-8')
+
+
+class BattleCacheTest(unittest.TestCase):
+
+    def test_keyed_by_principal_id(self):
+        cache = BattleCache()
+        cache.put('a', 1, 'battle a1', b'x')
+
+        self.assertEqual(cache.get('a', '1'), 'battle a1')
+        self.assertIsNone(cache.get('b', 1))
+        self.assertIsNone(cache.get('a', 2))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_least_recently_used_evicted(self):
+        cache = BattleCache(max_entries=2)
+        cache.put('a', 1, 1, b'x')
+        cache.put('a', 2, 2, b'x')
+        cache.get('a', 1)
+        cache.put('a', 3, 3, b'x')
+
+        self.assertIsNone(cache.get('a', 2))
+        self.assertEqual(cache.get('a', 1), 1)
+        self.assertEqual(cache.get('a', 3), 3)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_bytes_bounded(self):
+        cache = BattleCache(max_bytes=10)
+        cache.put('a', 1, 1, b'x' * 4)
+        cache.put('a', 2, 2, b'x' * 4)
+        # Replacing an entry counts its new size only
+        cache.put('a', 2, 2, b'x' * 5)
+        self.assertEqual(cache.stats['bytes'], 9)
+
+        cache.put('a', 3, 3, b'x' * 4)
+        self.assertIsNone(cache.get('a', 1))
+        self.assertEqual(cache.stats['bytes'], 9)
+
+        # Bigger than the whole cache, not kept at all
+        cache.put('a', 4, 4, b'x' * 11)
+        self.assertEqual((cache.stats['entries'], cache.stats['bytes']),
+                         (0, 0))
+
+    def test_disk(self):
+        raw = _raw(7)
+        BattleCache(disk=True).put('disk', 7, None, raw)
+
+        # A fresh process only has the table
+        cache = BattleCache(disk=True)
+        battle = cache.get('disk', 7)
+        self.assertIsInstance(battle, SP2BattleResult)
+        self.assertEqual(battle.battle_number, '7')
+        self.assertEqual(cache.disk_hits, 1)
+
+        self.assertIs(cache.get('disk', 7), battle)
+        self.assertEqual(cache.hits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from unittest import mock
+
+from sp2bot.fanout import SharedBattles
+
+
+class SharedBattlesTest(unittest.TestCase):
+
+    def test_first_pusher_claims(self):
+        shared = SharedBattles()
+        claim = shared.claim(-1, 100)
+        self.assertIsNotNone(claim)
+        self.assertIsNone(shared.claim(-1, 100))
+
+        # Other chats and battles are claimed separately
+        self.assertIsNotNone(shared.claim(-2, 100))
+        self.assertIsNotNone(shared.claim(-1, 200))
+        self.assertEqual(shared.claimed, 3)
+
+    def test_played_in_claimed(self):
+        shared = SharedBattles()
+        self.assertFalse(shared.played_in_claimed(-1, 100, 'a'))
+
+        claim = shared.claim(-1, 100)
+        # Not resolved yet, the battle waits for the next poll
+        self.assertIsNone(shared.played_in_claimed(-1, 100, 'a'))
+
+        claim.set_result({'a', 'b'})
+        self.assertTrue(shared.played_in_claimed(-1, 100, 'a'))
+        self.assertFalse(shared.played_in_claimed(-1, 100, 'c'))
+        self.assertEqual(shared.shared, 1)
+
+    def test_failed_claim(self):
+        shared = SharedBattles()
+        shared.claim(-1, 100).set_exception(Exception('fetch failed'))
+        self.assertFalse(shared.played_in_claimed(-1, 100, 'a'))
+
+    def test_claim_timeout(self):
+        shared = SharedBattles(timeout=30)
+        shared.claim(-1, 100)
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 31):
+            self.assertFalse(shared.played_in_claimed(-1, 100, 'a'))
+        self.assertEqual(shared.timeouts, 1)
+
+    def test_oldest_claim_dropped(self):
+        shared = SharedBattles(max_entries=2)
+        for start_time in (100, 200, 300):
+            shared.claim(-1, start_time)
+
+        self.assertEqual(shared.stats['claims'], 2)
+        self.assertIsNotNone(shared.claim(-1, 100))
+
+
+if __name__ == '__main__':
+    unittest.main()
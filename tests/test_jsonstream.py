@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from benchmarks import payloads
+from sp2bot.utils.jsonstream import iter_array
+
+
+class IterArrayTest(unittest.TestCase):
+
+    def test_matches_full_decode(self):
+        data = payloads.results(count=50)
+        items = list(iter_array(json.dumps(data, indent=1), 'results'))
+        self.assertEqual(items, data['results'])
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_array('{"results": [ ]}', 'results')), [])
+
+    def test_skips_nested_keys(self):
+        s = '{"summary": {"results": 3}, "note": "\\"results\\": [0]", ' \
+            '"results": [1, {"results": [2]}]}'
+        self.assertEqual(list(iter_array(s, 'results')),
+                         [1, {'results': [2]}])
+
+    def test_stops_early(self):
+        # Items after the ones read are never decoded
+        items = iter_array('{"results": [1, 2, oops]}', 'results')
+        self.assertEqual([next(items), next(items)], [1, 2])
+
+    def test_missing_array(self):
+        for s in ['{}', '{"summary": {"results": [1]}}', '{"results": 3}',
+                  '[1]', '{"results": [1 2]}']:
+            with self.assertRaises(ValueError, msg=s):
+                list(iter_array(s, 'results'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from unittest import mock
+
+from sp2bot import keepalive
+from sp2bot.keepalive import KeepAlive
+from sp2bot.models import User
+
+
+class Store:
+    # Users 1 to 10 with a session each
+
+    def __init__(self):
+        self.users = [User(i, f'user{i}', iksm_session=f'session{i}')
+                      for i in range(1, 11)]
+        self.invalidated = {}
+
+    def select_users_with_session(self, after_user_id=0, limit=500):
+        return [u for u in self.users if u.id > after_user_id][:limit]
+
+    def count_users_with_session(self):
+        return len(self.users)
+
+    def invalidate_sessions(self, iksm_sessions):
+        self.invalidated.update(iksm_sessions)
+        return len(iksm_sessions)
+
+
+class KeepAliveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store()
+        # User 2's session expired, checking user 5 fails
+        alive = {2: False, 5: None}
+        self.contacts = {}
+        for name, value in (
+                ('store', self.store),
+                ('_alive', lambda user: alive.get(user.id, True)),
+                ('last_contact', self.contacts.get)):
+            patcher = mock.patch.object(keepalive, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # Four slices of three users
+        self.keep_alive = KeepAlive(period=100, slice_interval=25,
+                                    concurrency=2)
+        self.addCleanup(self.keep_alive.shutdown)
+
+    def test_sweep_in_slices(self):
+        reports = [self.keep_alive.run_slice() for _ in range(4)]
+
+        self.assertEqual([r.checked for r in reports], [3, 3, 3, 1])
+        self.assertEqual([r.invalidated for r in reports], [1, 0, 0, 0])
+        self.assertEqual([r.failed for r in reports], [0, 1, 0, 0])
+        self.assertEqual(self.store.invalidated, {2: 'session2'})
+        self.assertEqual(self.keep_alive.sweeps, 1)
+
+    def test_next_sweep_waits_for_period(self):
+        for _ in range(4):
+            self.keep_alive.run_slice()
+        self.assertEqual(self.keep_alive.run_slice().checked, 0)
+
+        later = time.monotonic() + 100
+        with mock.patch('time.monotonic', return_value=later):
+            self.assertEqual(self.keep_alive.run_slice().checked, 3)
+
+    def test_recently_used_sessions_skipped(self):
+        now = time.monotonic()
+        self.contacts['session1'] = now
+        self.contacts['session2'] = now - self.keep_alive.fresh_for - 1
+
+        report = self.keep_alive.run_slice()
+        self.assertEqual((report.checked, report.skipped), (2, 1))
+        self.assertEqual(report.invalidated, 1)
+        self.assertEqual(self.keep_alive.stats['skipped'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
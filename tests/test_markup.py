@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import copy
+import unittest
+
+from benchmarks import payloads
+from sp2bot import message
+from sp2bot.message import Message, _battle_result_msg
+from sp2bot.splatoon2models import SP2BattleResult, SP2Player
+from sp2bot.utils.markup import escape_html, validate_html
+
+NICKNAMES = ['<b>x</b>', 'a&b', "it's", '"q"', '`code`', '</code>&lt',
+             '<a href="x">']
+
+
+class Viewer:
+
+    def __init__(self, principal_id):
+        self.principal_id = principal_id
+
+
+def _battle(nicknames, battle_number=1):
+    data = payloads.battle_detail(seed=battle_number,
+                                  battle_number=battle_number)
+    members = [data['player_result']] + data['my_team_members'] + \
+        data['other_team_members']
+    for member, nickname in zip(members, nicknames):
+        member['player']['nickname'] = nickname
+    return SP2BattleResult.de_json(copy.deepcopy(data))
+
+
+class ValidateHtmlTest(unittest.TestCase):
+
+    def test_accepts_telegram_markup(self):
+        for text in ['plain', '<b>bold</b> <i>i</i>', '<code>&lt;&amp;</code>',
+                     '<pre><code class="language-py">x</code></pre>',
+                     '<a href="https://x.y/?a=1&amp;b=2">link</a>',
+                     '&#60; &#x3c; &quot;']:
+            self.assertTrue(validate_html(text), text)
+
+    def test_rejects_bare_entities(self):
+        for text in ['a & b', '1 < 2', '2 > 1', '&amp', '<b>&</b>']:
+            self.assertFalse(validate_html(text), text)
+
+    def test_rejects_bad_nesting(self):
+        for text in ['<b><i>x</b></i>', '<b>x', 'x</b>', '<code><b>x</b></code>',
+                     '<div>x</div>', '<b class="x">x</b>']:
+            self.assertFalse(validate_html(text), text)
+
+    def test_escape_html(self):
+        for nickname in NICKNAMES:
+            escaped = escape_html(nickname)
+            self.assertTrue(validate_html(escaped), escaped)
+            self.assertTrue(validate_html(f'<b>{escaped}</b>'), escaped)
+            self.assertNotIn('<', escaped)
+            self.assertNotIn('"', escaped)
+
+
+class RenderedMessageTest(unittest.TestCase):
+
+    def test_battle_result_escapes_nicknames(self):
+        for offset in range(len(NICKNAMES)):
+            nicknames = NICKNAMES[offset:] + NICKNAMES[:offset]
+            battle = _battle(nicknames, battle_number=offset + 1)
+            viewer = Viewer(battle.player_result.player.principal_id)
+            highlights = {m.player.principal_id
+                          for m in battle.other_team_members}
+
+            content, _ = _battle_result_msg(battle, viewer,
+                                            highlights=highlights)
+            self.assertTrue(validate_html(content), content)
+            for nickname in nicknames:
+                self.assertIn(escape_html(nickname), content)
+
+    def test_rank_changed_escapes_nickname(self):
+        old = SP2Player.Udemae('S+', 1)
+        new = SP2Player.Udemae('S+', 2)
+        for nickname in NICKNAMES:
+            for ranks in ((old, new), (new, old)):
+                content, _ = Message.rank_changed('Splat <Zones>', nickname,
+                                                  *ranks)
+                self.assertTrue(validate_html(content), content)
+                self.assertIn(escape_html(nickname), content)
+
+
+class MemberLinesCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        message._member_lines.clear()
+
+    def test_lobbies_sharing_start_time(self):
+        first = _battle(NICKNAMES, battle_number=1)
+        second = _battle(list(reversed(NICKNAMES)), battle_number=2)
+        second.start_time = first.start_time
+        for battle in (first, second, first):
+            viewer = Viewer(battle.player_result.player.principal_id)
+            cached, _ = _battle_result_msg(battle, viewer)
+            uncached, _ = _battle_result_msg(battle, viewer, cache=False)
+            self.assertEqual(cached, uncached)
+
+    def test_viewers_of_a_shared_battle(self):
+        battle = _battle(NICKNAMES)
+        highlights = {battle.other_team_members[0].player.principal_id}
+        principal_ids = [m.player.principal_id for m in
+                         battle.my_team_members + battle.other_team_members]
+        viewers = [Viewer(principal_id)
+                   for principal_id in principal_ids] + [Viewer('nobody')]
+        for viewer in viewers:
+            cached, _ = _battle_result_msg(battle, viewer,
+                                           highlights=highlights)
+            uncached, _ = _battle_result_msg(battle, viewer,
+                                             highlights=highlights,
+                                             cache=False)
+            self.assertEqual(cached, uncached)
+            marked = highlights | {viewer.principal_id}
+            self.assertEqual(cached.count(message._SELF_MARKER),
+                             sum(p in marked for p in principal_ids))
+
+    def test_uncached_render_stores_nothing(self):
+        battle = _battle(NICKNAMES)
+        _battle_result_msg(battle, Viewer('nobody'), cache=False)
+        self.assertEqual(len(message._member_lines), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+from sp2bot.medals import MedalTracker
+from sp2bot.splatoon2models import SP2LeagueMedals, league_rotation_end
+
+
+class User:
+
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class Poll:
+
+    def __init__(self, flag_medal=0, medal_due_at=None, medals=None):
+        self.user = User(1)
+        self.flag_medal = flag_medal
+        self.medal_due_at = medal_due_at
+        self.medals_pair = medals
+        self.medals_team = medals
+
+
+class Splatoon2:
+
+    def __init__(self, gold_count=0):
+        self.gold_count = gold_count
+        self.requests = 0
+
+    def get_records(self):
+        self.requests += 1
+        medals = {'gold_count': self.gold_count, 'silver_count': 0,
+                  'bronze_count': 0, 'no_medal_count': 0}
+        return {'records': {'league_stats': {'pair': medals,
+                                             'team': dict(medals)}}}
+
+
+class MedalTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = MedalTracker(retry_interval=0, give_up_after=3600)
+
+    def test_first_check_takes_snapshot(self):
+        poll, splatoon2 = Poll(), Splatoon2(gold_count=2)
+        self.assertIsNone(self.tracker.check(poll, splatoon2))
+        self.assertEqual(poll.medals_pair, SP2LeagueMedals(gold_count=2))
+
+        # No League battle, nothing to fetch
+        self.assertIsNone(self.tracker.check(poll, splatoon2))
+        self.assertEqual(splatoon2.requests, 1)
+
+    def test_waits_for_rotation_end(self):
+        poll = Poll(flag_medal=1, medal_due_at=time.time() + 60,
+                    medals=SP2LeagueMedals())
+        splatoon2 = Splatoon2(gold_count=1)
+        self.assertIsNone(self.tracker.check(poll, splatoon2))
+        self.assertEqual(splatoon2.requests, 0)
+
+    def test_reports_new_medal(self):
+        poll = Poll(flag_medal=1, medal_due_at=time.time() - 60,
+                    medals=SP2LeagueMedals())
+        content = self.tracker.check(poll, Splatoon2(gold_count=1))
+        self.assertIn('🥇', content)
+        self.assertEqual(poll.flag_medal, 0)
+        self.assertIsNone(poll.medal_due_at)
+
+    def test_retries_then_gives_up(self):
+        poll = Poll(flag_medal=1, medal_due_at=time.time() - 60,
+                    medals=SP2LeagueMedals())
+        splatoon2 = Splatoon2()
+        self.assertIsNone(self.tracker.check(poll, splatoon2))
+        self.assertEqual(poll.flag_medal, 1)
+
+        poll.medal_due_at = time.time() - 3601
+        self.assertIsNone(self.tracker.check(poll, splatoon2))
+        self.assertEqual(poll.flag_medal, 0)
+        self.assertEqual(splatoon2.requests, 2)
+
+    def test_missing_due_time_checks_once(self):
+        poll = Poll(flag_medal=1, medals=SP2LeagueMedals())
+        splatoon2 = Splatoon2()
+        self.assertIsNone(self.tracker.check(poll, splatoon2))
+        self.assertIsNone(self.tracker.check(poll, splatoon2))
+        self.assertEqual(poll.flag_medal, 0)
+        self.assertEqual(splatoon2.requests, 1)
+
+    def test_rotation_end(self):
+        self.assertEqual(league_rotation_end(7200), 14400)
+        self.assertEqual(league_rotation_end(14399.5), 14400)
+
+
+if __name__ == '__main__':
+    unittest.main()
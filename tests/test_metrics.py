@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+
+from sp2bot import metrics
+from sp2bot.metrics import Histogram, PrometheusSink
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_quantiles(self):
+        histogram = Histogram(buckets=(0.1, 1.0, 10.0))
+        for value in (0.05, 0.05, 0.5, 5.0):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(0.99), 10.0)
+        histogram.observe(100)
+        self.assertEqual(histogram.quantile(1), float('inf'))
+        self.assertEqual(histogram.stats['count'], 5)
+
+
+class RenderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = metrics.get_sink()
+        metrics.set_sink(PrometheusSink())
+
+    def tearDown(self):
+        metrics.set_sink(self.sink)
+
+    def test_mixed_label_values(self):
+        # Status is an int for responses, a string for failures
+        metrics.inc('nintendo_total', status=200)
+        metrics.inc('nintendo_total', status='timeout')
+        metrics.inc('nintendo_total', status=200)
+        metrics.observe('stage_seconds', 0.2, stage='nintendo', status=304)
+        metrics.observe('stage_seconds', 0.3, stage='nintendo',
+                        status='error')
+
+        text = metrics.render()
+        self.assertIn('sp2bot_nintendo_total{status="200"} 2', text)
+        self.assertIn('sp2bot_nintendo_total{status="timeout"} 1', text)
+        self.assertIn('sp2bot_stage_seconds_count'
+                      '{stage="nintendo",status="error"} 1', text)
+        self.assertEqual(text.count('# TYPE sp2bot_stage_seconds '
+                                    'histogram'), 1)
+
+    def test_histogram_buckets_are_cumulative(self):
+        metrics.observe('push_seconds', 0.003)
+        metrics.observe('push_seconds', 50)
+
+        text = metrics.render()
+        self.assertIn('sp2bot_push_seconds_bucket{le="0.005"} 1', text)
+        self.assertIn('sp2bot_push_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('sp2bot_push_seconds_count 2', text)
+
+    def test_escapes_label_values(self):
+        metrics.inc('handler_total', handler='a"b\\c\nd')
+        self.assertIn('sp2bot_handler_total{handler="a\\"b\\\\c\\nd"} 1',
+                      metrics.render())
+
+    def test_gauges(self):
+        metrics.register_gauges('test', lambda: {'depth': 3, 'ok': True,
+                                                 'name': 'x'})
+        try:
+            text = metrics.render()
+        finally:
+            metrics._gauges.pop('test')
+        self.assertIn('sp2bot_test_depth 3\n', text)
+        self.assertNotIn('sp2bot_test_ok', text)
+        self.assertNotIn('sp2bot_test_name', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
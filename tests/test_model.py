@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+
+from benchmarks import payloads
+from sp2bot.splatoon2models import SP2BattleResult
+from sp2bot.utils.model import LazyList, LazyModel
+
+
+class LazyListTest(unittest.TestCase):
+
+    def test_decodes_on_first_access(self):
+        decoded = []
+
+        def decode(item):
+            decoded.append(item)
+            return item * 10
+
+        items = LazyList([1, 2, 3], decode)
+        self.assertEqual(len(items), 3)
+        self.assertEqual(decoded, [])
+
+        self.assertEqual(items[1], 20)
+        self.assertEqual(items[1], 20)
+        self.assertEqual(decoded, [2])
+
+        self.assertEqual(items[-1], 30)
+        self.assertEqual(items[:2], [10, 20])
+        self.assertEqual(list(items), [10, 20, 30])
+        self.assertEqual(decoded, [2, 3, 1])
+
+    def test_empty(self):
+        items = LazyList(None, lambda item: item)
+        self.assertEqual(len(items), 0)
+        self.assertEqual(list(items), [])
+        with self.assertRaises(IndexError):
+            _ = items[0]
+
+
+class LazyModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = payloads.battle_detail(seed=1, battle_number=42)
+        self.decoded = 0
+
+    def _decode(self, data):
+        self.decoded += 1
+        return SP2BattleResult.de_json(data)
+
+    def _lazy(self):
+        return LazyModel(self._decode, self.data, {
+            'battle_number': lambda d: d['battle_number'],
+            'victory': lambda d: d['my_team_result']['key'] == 'victory',
+        })
+
+    def test_cheap_fields_do_not_decode(self):
+        battle = self._lazy()
+        self.assertEqual(battle.battle_number, '42')
+        self.assertEqual(battle.victory,
+                         self.data['my_team_result']['key'] == 'victory')
+        self.assertEqual(battle.battle_number, '42')
+        self.assertEqual(self.decoded, 0)
+
+    def test_other_fields_decode_once(self):
+        battle = self._lazy()
+        eager = SP2BattleResult.de_json(self.data)
+        self.assertEqual(battle.rule.key, eager.rule.key)
+        self.assertEqual(battle.victory, eager.victory)
+        self.assertEqual(battle.player_result.kill_count,
+                         eager.player_result.kill_count)
+        self.assertEqual(self.decoded, 1)
+
+    def test_has_no_instance_dict(self):
+        battle = self._lazy()
+        _ = battle.victory
+        self.assertFalse(hasattr(battle, '__dict__'))
+        with self.assertRaises(AttributeError):
+            _ = battle._missing
+
+    def test_lazy_overview_battles(self):
+        battle = SP2BattleResult.de_lazy(self.data)
+        self.assertEqual(battle.battle_number, '42')
+        self.assertEqual(battle.start_time, self.data['start_time'])
+
+
+if __name__ == '__main__':
+    unittest.main()
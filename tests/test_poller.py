@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+from sp2bot.poller import PollJob, PollScheduler
+
+RESOLUTION = 0.01
+
+
+class PollSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = PollScheduler(interval=0.1, resolution=RESOLUTION,
+                                       max_rate=0, workers=2)
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+
+    def _job(self, name, callback=None, interval=0.1):
+        return PollJob(name, callback or (lambda job: None), interval)
+
+    def _tick_after(self, seconds):
+        time.sleep(seconds)
+        return self.scheduler.tick()
+
+    def test_runs_due_jobs(self):
+        ran = threading.Event()
+        self.scheduler.add(self._job('a', lambda job: ran.set()), first=0)
+
+        metrics = self._tick_after(RESOLUTION * 2)
+        self.assertEqual(metrics.due, 1)
+        self.assertEqual(metrics.dispatched, 1)
+        self.assertTrue(ran.wait(1))
+
+    def test_not_due_yet(self):
+        self.scheduler.add(self._job('a'), first=1)
+        metrics = self._tick_after(RESOLUTION * 2)
+        self.assertEqual(metrics.due, 0)
+        self.assertEqual(self.scheduler.job_count, 1)
+
+    def test_removed_job_never_runs(self):
+        ran = threading.Event()
+        job = self._job('a', lambda job: ran.set())
+        self.scheduler.add(job, first=0)
+        self.scheduler.remove(job)
+
+        metrics = self._tick_after(RESOLUTION * 2)
+        self.assertEqual(metrics.dispatched, 0)
+        self.assertFalse(ran.is_set())
+        self.assertEqual(self.scheduler.job_count, 0)
+
+    def test_rate_limit_defers(self):
+        scheduler = PollScheduler(interval=0.1, resolution=RESOLUTION,
+                                  max_rate=1, workers=2)
+        try:
+            for name in 'abc':
+                scheduler.add(self._job(name), first=0)
+            time.sleep(RESOLUTION * 2)
+
+            metrics = scheduler.tick()
+            self.assertEqual(metrics.due, 3)
+            self.assertEqual(metrics.dispatched, 1)
+            self.assertEqual(metrics.deferred, 2)
+        finally:
+            scheduler.shutdown()
+
+    def test_running_job_is_skipped(self):
+        release = threading.Event()
+        started = threading.Event()
+        runs = []
+
+        def callback(job):
+            runs.append(job)
+            started.set()
+            release.wait(1)
+
+        job = self._job('a', callback)
+        self.scheduler.add(job, first=0)
+        self._tick_after(RESOLUTION * 2)
+        self.assertTrue(started.wait(1))
+        self.assertTrue(job.running)
+
+        # Due again while its poll is still in flight
+        self.scheduler.add(job, first=0)
+        metrics = self._tick_after(RESOLUTION * 2)
+        self.assertEqual(metrics.due, 1)
+        self.assertEqual(metrics.skipped, 1)
+        self.assertEqual(metrics.dispatched, 0)
+
+        release.set()
+        self.scheduler.shutdown()
+        self.assertEqual(len(runs), 1)
+
+if __name__ == '__main__':
+    unittest.main()
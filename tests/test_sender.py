@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from unittest import mock
+
+from telegram.error import BadRequest, RetryAfter
+
+from sp2bot import sender as sender_module
+from sp2bot.sender import MessageSender
+
+
+class Bot:
+    # Records calls, raises the queued errors first
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = []
+
+    def send_message(self, **kwargs):
+        self.calls.append(('send_message', dict(kwargs)))
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None:
+                raise error
+        return len(self.calls)
+
+    def delete_message(self, **kwargs):
+        self.calls.append(('delete_message', dict(kwargs)))
+        return True
+
+
+class MessageSenderTest(unittest.TestCase):
+
+    def setUp(self):
+        # No waiting between sends, the worker is driven by the test
+        for name in ('COALESCE_WINDOW', 'PRIVATE_CHAT_INTERVAL',
+                     'GROUP_CHAT_INTERVAL'):
+            patcher = mock.patch.object(sender_module, name, 0)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.bot = Bot()
+        self.sender = MessageSender()
+        self.sender.bot = self.bot
+        self.sender._running = True
+
+    def _drain(self):
+        while self.sender.depth:
+            self.sender._send(self.sender._next())
+
+    def test_chat_order(self):
+        for i in range(3):
+            self.sender.send_message(1, f'a{i}')
+            self.sender.send_message(-2, f'b{i}')
+        self.sender.delete_message(1, 10)
+        self._drain()
+
+        texts = [kwargs.get('text', kwargs.get('message_id'))
+                 for _, kwargs in self.bot.calls if kwargs['chat_id'] == 1]
+        self.assertEqual(texts, ['a0', 'a1', 'a2', 10])
+        self.assertEqual(self.sender.sent, 7)
+
+    def test_coalesce(self):
+        first = self.sender.send_message(1, 'a', coalesce=True)
+        second = self.sender.send_message(1, 'b', coalesce=True)
+        other_chat = self.sender.send_message(2, 'c', coalesce=True)
+        plain = self.sender.send_message(1, 'd')
+        self._drain()
+
+        self.assertEqual([kwargs['text'] for _, kwargs in self.bot.calls],
+                         ['a\n\nb', 'c', 'd'])
+        self.assertEqual(self.sender.coalesced, 1)
+        self.assertEqual(first.result(0), second.result(0))
+        self.assertTrue(other_chat.done() and plain.done())
+
+    def test_invalid_html_sent_as_text(self):
+        self.sender.send_message(1, '1 < 2', parse_mode='HTML')
+        self._drain()
+
+        self.assertNotIn('parse_mode', self.bot.calls[0][1])
+        self.assertEqual(self.sender.invalid_markups, 1)
+
+    def test_parse_fallback(self):
+        self.bot.errors = [BadRequest("Can't parse entities")]
+        future = self.sender.send_message(1, '<b>x</b>', parse_mode='HTML')
+        self._drain()
+
+        self.assertEqual(len(self.bot.calls), 2)
+        self.assertNotIn('parse_mode', self.bot.calls[1][1])
+        self.assertEqual(self.sender.parse_fallbacks, 1)
+        self.assertEqual(future.result(0), 2)
+
+    def test_bad_request_fails(self):
+        self.bot.errors = [BadRequest('Chat not found')]
+        future = self.sender.send_message(1, 'x')
+        self._drain()
+
+        self.assertEqual(self.sender.failed, 1)
+        self.assertIsInstance(future.exception(0), BadRequest)
+
+    def test_retry_after_pauses_all_chats(self):
+        self.bot.errors = [RetryAfter(5)]
+        future = self.sender.send_message(1, 'x')
+        self.sender.send_message(2, 'y')
+
+        self.sender._send(self.sender._next())
+        self.assertEqual(self.sender.retried, 1)
+        self.assertGreater(self.sender._paused_until, time.monotonic() + 4)
+        self.assertEqual(self.sender._queue[0].kwargs['text'], 'x')
+        self.assertFalse(future.done())
+
+
+if __name__ == '__main__':
+    unittest.main()
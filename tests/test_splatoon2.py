@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from benchmarks import payloads
+from sp2bot.splatoon2 import Splatoon2
+
+
+class Response:
+
+    def __init__(self, status, data=b'', headers=None):
+        self.status = status
+        self.data = data
+        self.headers = headers or {}
+
+
+class Splatoon2Stub(Splatoon2):
+    # Answers /api/results like Nintendo, honouring If-None-Match
+
+    def __init__(self, etag):
+        super(Splatoon2Stub, self).__init__('session')
+        self.etag = etag
+        self.body = json.dumps(payloads.results(count=5)).encode('utf-8')
+        self.sent_headers = []
+
+    def _send(self, method, path, headers=None):
+        self.sent_headers.append(headers or {})
+        if (headers or {}).get('If-None-Match') == self.etag:
+            return Response(304)
+        return Response(200, self.body, {'ETag': self.etag})
+
+
+class BattleOverviewTest(unittest.TestCase):
+
+    def test_only_newer_battles(self):
+        splatoon2 = Splatoon2Stub('"a"')
+        overview = splatoon2.get_battle_overview(since=4997)
+        self.assertEqual([b.battle_number for b in overview.results],
+                         ['5000', '4999', '4998'])
+
+        overview = splatoon2.get_battle_overview(since=4997, limit=1)
+        self.assertEqual(len(overview.results), 1)
+
+    def test_validators_wait_for_save(self):
+        splatoon2 = Splatoon2Stub('"a"')
+        self.assertEqual(len(splatoon2.get_battle_overview(since=4999)
+                             .results), 1)
+
+        # Battles not handled yet, downloaded again
+        self.assertEqual(len(splatoon2.get_battle_overview(since=4999)
+                             .results), 1)
+        self.assertNotIn('If-None-Match', splatoon2.sent_headers[-1])
+
+        splatoon2.save_validators()
+        self.assertEqual(splatoon2.get_battle_overview(since=4999).results,
+                         [])
+        self.assertEqual(splatoon2.sent_headers[-1]['If-None-Match'], '"a"')
+
+        # Changed overview, the saved validators stay until saved again
+        splatoon2.etag = '"b"'
+        self.assertEqual(len(splatoon2.get_battle_overview(since=4999)
+                             .results), 1)
+        self.assertEqual(splatoon2.get_battle_overview(since=4999)
+                         .results[0].battle_number, '5000')
+        self.assertEqual(splatoon2.sent_headers[-1]['If-None-Match'], '"a"')
+
+
+if __name__ == '__main__':
+    unittest.main()
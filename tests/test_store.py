@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+
+from telegram import Chat
+
+from sp2bot import store
+from sp2bot.models import BattlePoll, User
+from sp2bot.splatoon2models import SP2Player
+
+
+def _insert_user(user_id, iksm_session='session'):
+    user = User(user_id, f'user{user_id}', iksm_session=iksm_session,
+                sp2_user=SP2Player(f'{user_id:016x}', nickname='nick',
+                                   style='girl', species='inklings'))
+    store.insert_user(user)
+    return user
+
+
+def _table_row(user_id):
+    # Straight from the table, past the cache
+    session = store.DBSession()
+    u = session.get(store.UserTable, user_id)
+    session.close()
+    return store._user_row(u) if u else None
+
+
+class UserCacheTest(unittest.TestCase):
+
+    def test_select_user_cached(self):
+        _insert_user(401)
+        session = store.DBSession()
+        session.get(store.UserTable, 401).first_name = 'changed elsewhere'
+        session.commit()
+        session.close()
+
+        self.assertEqual(store.select_user(401).first_name, 'user401')
+        self.assertEqual(store.select_user(401).sp2_user.principal_id,
+                         f'{401:016x}')
+
+    def test_missing_user_cached(self):
+        self.assertIsNone(store.select_user(402))
+        self.assertIn(402, store._user_cache)
+
+        _insert_user(402)
+        self.assertEqual(store.select_user(402).first_name, 'user402')
+
+    def test_update_user(self):
+        user = _insert_user(403)
+        user.first_name = 'renamed'
+        user.iksm_session = 'new session'
+        store.update_user(user)
+
+        self.assertEqual(store.select_user(403).first_name, 'renamed')
+        self.assertEqual(_table_row(403)['iksm_session'], 'new session')
+
+    def test_push_and_sessions_keep_cache_in_sync(self):
+        _insert_user(404, iksm_session='old')
+        _insert_user(405, iksm_session='kept')
+        store.update_push_to_false(404)
+
+        # 405 set a new session since the sweep looked at it
+        self.assertEqual(store.invalidate_sessions({404: 'old', 405: 'stale'}),
+                         1)
+
+        for user_id in (404, 405):
+            user, row = store.select_user(user_id), _table_row(user_id)
+            self.assertEqual((user.iksm_session, user.push),
+                             (row['iksm_session'], row['push']))
+        self.assertEqual(store.select_user(404).iksm_session, '')
+        self.assertFalse(store.select_user(404).push)
+        self.assertEqual(store.select_user(405).iksm_session, 'kept')
+
+
+class BattlePollTest(unittest.TestCase):
+
+    def test_dirty_tracking(self):
+        battle_poll = BattlePoll(User(501, 'user501'), Chat(-1, 'group'))
+        self.assertTrue(battle_poll.dirty)
+
+        battle_poll.mark_clean()
+        battle_poll.last_battle_number = None
+        self.assertFalse(battle_poll.dirty)
+
+        battle_poll.back_off(10, 10, 0)
+        self.assertTrue(battle_poll.dirty)
+        battle_poll.mark_clean()
+        # Idle at the slowest rate, nothing to write
+        battle_poll.back_off(10, 10, 0)
+        self.assertFalse(battle_poll.dirty)
+
+        battle_poll.reset_poll_interval()
+        self.assertTrue(battle_poll.dirty)
+
+    def test_flushed_polls_restored_clean(self):
+        user = _insert_user(502)
+        battle_poll = BattlePoll(user, Chat(-1, 'group'))
+        battle_poll.last_battle_number = '5000'
+        store.update_battle_polls([battle_poll])
+
+        restored = [p for p in store.get_started_push_poll()
+                    if p.user.id == 502]
+        self.assertEqual(len(restored), 1)
+        self.assertEqual(restored[0].last_battle_number, '5000')
+        self.assertFalse(restored[0].dirty)
+        self.assertTrue(store.select_user(502).push)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from unittest import mock
+
+from sp2bot.verifiers import MemoryVerifierStore, SQLVerifierStore
+
+
+class MemoryVerifierStoreTest(unittest.TestCase):
+
+    def test_put_get_discard(self):
+        verifiers = MemoryVerifierStore()
+        verifiers.put(1, b'a')
+        verifiers.put(1, b'b')
+        self.assertEqual(verifiers.get(1), b'b')
+        self.assertIsNone(verifiers.get(2))
+
+        verifiers.discard(1)
+        verifiers.discard(1)
+        self.assertIsNone(verifiers.get(1))
+
+    def test_expired(self):
+        verifiers = MemoryVerifierStore(ttl=600)
+        verifiers.put(1, b'a')
+        with mock.patch('time.time', return_value=time.time() + 601):
+            self.assertIsNone(verifiers.get(1))
+
+            # Expired ones go with the next put
+            verifiers.put(2, b'b')
+        self.assertEqual(len(verifiers), 1)
+
+    def test_oldest_dropped_when_full(self):
+        verifiers = MemoryVerifierStore(max_entries=2)
+        for user_id in (1, 2, 1, 3):
+            verifiers.put(user_id, b'x')
+
+        self.assertIsNone(verifiers.get(2))
+        self.assertEqual(verifiers.get(1), b'x')
+        self.assertEqual(len(verifiers), 2)
+
+
+class SQLVerifierStoreTest(unittest.TestCase):
+
+    def test_shared_between_stores(self):
+        SQLVerifierStore().put(301, b'a')
+        SQLVerifierStore().put(301, b'b')
+
+        # Another process reads it back
+        verifiers = SQLVerifierStore()
+        self.assertEqual(verifiers.get(301), b'b')
+        verifiers.discard(301)
+        self.assertIsNone(SQLVerifierStore().get(301))
+
+    def test_expired(self):
+        verifiers = SQLVerifierStore(ttl=600)
+        verifiers.put(302, b'a')
+        with mock.patch('time.time', return_value=time.time() + 601):
+            self.assertIsNone(verifiers.get(302))
+
+
+if __name__ == '__main__':
+    unittest.main()